@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+# async_database.py
+
+import asyncio
+import functools
+import itertools
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import database_manager
+import license_csv
+from bot_config import DB_READER_THREADS
+
+# Настройки логирования
+logger = logging.getLogger(__name__)
+
+# Сколько операций записи из очереди объединять в одну транзакцию
+MAX_WRITE_BATCH = 200
+
+# Чтение выполняется в пуле потоков, запись — в одном отдельном потоке,
+# поэтому обращения к SQLite не блокируют цикл событий
+_reader_pool = ThreadPoolExecutor(max_workers=DB_READER_THREADS, thread_name_prefix='db-reader')
+_write_queue = queue.Queue()
+_writer_thread = None
+_writer_lock = threading.Lock()
+
+
+def _set_future_result(future, success, value):
+    if future.cancelled():
+        return
+    if success:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
+
+
+def _run_write_batch(batch):
+    results = []
+    try:
+        with database_manager.transaction():
+            for func, args, kwargs, _, _ in batch:
+                # Каждая операция в своей точке сохранения: ошибка одной не отменяет остальные
+                try:
+                    with database_manager.transaction():
+                        results.append((True, func(*args, **kwargs)))
+                except Exception as e:
+                    results.append((False, e))
+    except Exception as e:
+        logger.error(f"Ошибка при записи пакета из {len(batch)} операций в базу данных: {e}")
+        results = [(False, e)] * len(batch)
+
+    for (_, _, _, future, loop), (success, value) in zip(batch, results):
+        loop.call_soon_threadsafe(_set_future_result, future, success, value)
+
+
+def _writer_loop():
+    running = True
+    while running:
+        item = _write_queue.get()
+        if item is None:
+            break
+        # Все операции, накопившиеся в очереди, записываются одной транзакцией
+        batch = [item]
+        while len(batch) < MAX_WRITE_BATCH:
+            try:
+                item = _write_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                running = False
+                break
+            batch.append(item)
+        _run_write_batch(batch)
+    database_manager.close_connection()
+
+
+def _ensure_writer():
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_writer_loop, name='db-writer', daemon=True)
+            _writer_thread.start()
+
+
+async def run_read(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_reader_pool, functools.partial(func, *args, **kwargs))
+
+
+async def run_write(func, *args, **kwargs):
+    _ensure_writer()
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _write_queue.put((func, args, kwargs, future, loop))
+    return await future
+
+
+def _read_batch(iter_func, after_id, batch_size):
+    return list(itertools.islice(iter_func(after_id, batch_size), batch_size))
+
+
+async def _iter_table(iter_func, batch_size):
+    # Курсор нельзя передать между потоками пула, поэтому каждый пакет читается
+    # отдельным запросом, продолжающим обход после id последней строки
+    after_id = 0
+    while True:
+        rows = await run_read(_read_batch, iter_func, after_id, batch_size)
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        after_id = rows[-1].id
+
+
+def _shutdown():
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is not None and _writer_thread.is_alive():
+            _write_queue.put(None)
+            _writer_thread.join()
+        _writer_thread = None
+
+
+async def close():
+    # Дожидаемся записи всех операций из очереди
+    await asyncio.get_running_loop().run_in_executor(None, _shutdown)
+
+
+# Функции для работы с уведомлениями о лицензиях
+async def save_notification_to_db(
+    user_id, company, product, expiry_day, notify_date, quantity, notification_type
+):
+    return await run_write(
+        database_manager.save_notification_to_db,
+        user_id,
+        company,
+        product,
+        expiry_day,
+        notify_date,
+        quantity,
+        notification_type,
+    )
+
+
+async def import_notifications(user_id, notifications, notification_type):
+    return await run_write(
+        database_manager.import_notifications, user_id, notifications, notification_type
+    )
+
+
+async def export_notifications_csv():
+    return await run_read(license_csv.export_licenses_csv)
+
+
+async def notification_exists(company, product):
+    return await run_read(database_manager.notification_exists, company, product)
+
+
+async def delete_notification_from_db(notif_id):
+    return await run_write(database_manager.delete_notification_from_db, notif_id)
+
+
+async def get_notifications_from_db():
+    return await run_read(database_manager.get_notifications_from_db)
+
+
+def iter_notifications(batch_size=database_manager.STREAM_BATCH_SIZE):
+    return _iter_table(database_manager.iter_notifications, batch_size)
+
+
+async def get_notifications_page(after=None, before=None, limit=10):
+    return await run_read(database_manager.get_notifications_page, after, before, limit)
+
+
+# Функции для работы с напоминаниями по лицензиям
+async def schedule_reminders(reminders):
+    return await run_write(database_manager.schedule_reminders, reminders)
+
+
+async def reset_sending_reminders():
+    return await run_write(database_manager.reset_sending_reminders)
+
+
+async def clear_pending_reminders():
+    return await run_write(database_manager.clear_pending_reminders)
+
+
+async def skip_superseded_reminders():
+    return await run_write(database_manager.skip_superseded_reminders)
+
+
+async def get_due_reminders(now):
+    return await run_read(database_manager.get_due_reminders, now)
+
+
+async def get_next_reminder_due():
+    return await run_read(database_manager.get_next_reminder_due)
+
+
+async def claim_reminder(notification_id, kind, due_day, status='sending'):
+    return await run_write(database_manager.claim_reminder, notification_id, kind, due_day, status)
+
+
+async def mark_reminder_sent(notification_id, kind, due_day):
+    return await run_write(database_manager.mark_reminder_sent, notification_id, kind, due_day)
+
+
+async def release_reminder(notification_id, kind, due_day, retry_at):
+    return await run_write(
+        database_manager.release_reminder, notification_id, kind, due_day, retry_at
+    )
+
+
+# Функции для работы с мониторингом сайтов
+async def add_monitored_site(site):
+    return await run_write(database_manager.add_monitored_site, site)
+
+
+async def add_monitored_sites(sites):
+    return await run_write(database_manager.add_monitored_sites, sites)
+
+
+async def get_monitored_sites():
+    return await run_read(database_manager.get_monitored_sites)
+
+
+async def remove_monitored_site(site):
+    return await run_write(database_manager.remove_monitored_site, site)
+
+
+async def update_certificate_info(site, expiry_at, common_name, last_checked_at=None, fingerprint=None):
+    return await run_write(
+        database_manager.update_certificate_info, site, expiry_at, common_name, last_checked_at, fingerprint
+    )
+
+
+async def replace_certificate_addresses(site, results, checked_at):
+    return await run_write(database_manager.replace_certificate_addresses, site, results, checked_at)
+
+
+async def get_certificate_history_state(site, fingerprint):
+    return await run_read(database_manager.get_certificate_history_state, site, fingerprint)
+
+
+async def add_certificate_history(
+    site, fingerprint, common_name, issuer, sans, key_type, not_before, not_after, first_seen_at
+):
+    return await run_write(
+        database_manager.add_certificate_history,
+        site,
+        fingerprint,
+        common_name,
+        issuer,
+        sans,
+        key_type,
+        not_before,
+        not_after,
+        first_seen_at,
+    )
+
+
+async def record_probe_failure(site, probe_state, failure_count, retry_at, last_error):
+    return await run_write(
+        database_manager.record_probe_failure, site, probe_state, failure_count, retry_at, last_error
+    )
+
+
+async def count_monitored_sites():
+    return await run_read(database_manager.count_monitored_sites)
+
+
+def iter_monitored_sites(batch_size=database_manager.STREAM_BATCH_SIZE):
+    return _iter_table(database_manager.iter_monitored_sites, batch_size)
+
+
+async def get_sites_page(after=None, before=None, limit=10):
+    return await run_read(database_manager.get_sites_page, after, before, limit)
+
+
+async def get_certificate_info(site):
+    return await run_read(database_manager.get_certificate_info, site)
+
+
+async def get_site_by_id(site_id):
+    return await run_read(database_manager.get_site_by_id, site_id)
+
+
+# Функции для учета отправленных предупреждений о сертификатах
+async def get_certificate_file_index():
+    return await run_read(database_manager.get_certificate_file_index)
+
+
+async def save_certificate_files(results, scanned_at):
+    return await run_write(database_manager.save_certificate_files, results, scanned_at)
+
+
+async def remove_certificate_files(paths):
+    return await run_write(database_manager.remove_certificate_files, paths)
+
+
+async def get_expiring_file_certificates(until):
+    return await run_read(database_manager.get_expiring_file_certificates, until)
+
+
+async def claim_certificate_alert(site, fingerprint, threshold):
+    return await run_write(database_manager.claim_certificate_alert, site, fingerprint, threshold)
+
+
+async def clear_expired_certificate_alerts(site, expired_before):
+    return await run_write(database_manager.clear_expired_certificate_alerts, site, expired_before)
+
+
+# Функции для управления разрешенными пользователями
+async def add_allowed_user(user_id, username, first_name, last_name):
+    return await run_write(
+        database_manager.add_allowed_user, user_id, username, first_name, last_name
+    )
+
+
+async def get_allowed_users():
+    if database_manager.is_acl_cache_fresh():
+        return database_manager.get_allowed_users()
+    return await run_read(database_manager.get_allowed_users)
+
+
+async def is_user_allowed(user_id):
+    # Проверка по кэшу в памяти не требует обращения к базе
+    if database_manager.is_acl_cache_fresh():
+        return database_manager.is_user_allowed(user_id)
+    return await run_read(database_manager.is_user_allowed, user_id)
+
+
+# Функции для управления запросами на доступ
+async def add_access_request(user_id, username, first_name, last_name):
+    return await run_write(
+        database_manager.add_access_request, user_id, username, first_name, last_name
+    )
+
+
+async def remove_access_request(user_id):
+    return await run_write(database_manager.remove_access_request, user_id)
+
+
+async def is_access_request_pending(user_id):
+    return await run_read(database_manager.is_access_request_pending, user_id)
+
+
+async def get_access_request_info(user_id):
+    return await run_read(database_manager.get_access_request_info, user_id)
+
+
+# Функции для управления разрешенными чатами
+async def add_allowed_chat(chat_id):
+    return await run_write(database_manager.add_allowed_chat, chat_id)
+
+
+async def is_chat_allowed(chat_id):
+    if database_manager.is_acl_cache_fresh():
+        return database_manager.is_chat_allowed(chat_id)
+    return await run_read(database_manager.is_chat_allowed, chat_id)
+
+
+async def get_allowed_chats():
+    if database_manager.is_acl_cache_fresh():
+        return database_manager.get_allowed_chats()
+    return await run_read(database_manager.get_allowed_chats)
@@ -9,4 +9,46 @@ config.read('config.ini', encoding='utf-8')
 TOKEN = config.get('Telegram', 'TOKEN')
 ADMIN_ID = int(config.get('Telegram', 'ADMIN_ID'))
 DB_PATH = config.get('Database', 'DB_PATH')
-  
+DB_READER_THREADS = config.getint('Database', 'READER_THREADS', fallback=4)
+ACL_CACHE_TTL = config.getint('Database', 'ACL_CACHE_TTL', fallback=0)
+
+# Ограничения частоты отправки сообщений (необязательные)
+SEND_RATE_GLOBAL = config.getfloat('Telegram', 'SEND_RATE_GLOBAL', fallback=30)
+SEND_RATE_PRIVATE_CHAT = config.getfloat('Telegram', 'SEND_RATE_PRIVATE_CHAT', fallback=1)
+SEND_RATE_GROUP_CHAT_PER_MINUTE = config.getfloat('Telegram', 'SEND_RATE_GROUP_CHAT_PER_MINUTE', fallback=20)
+SEND_MAX_RETRIES = config.getint('Telegram', 'SEND_MAX_RETRIES', fallback=3)
+
+# Настройки проверки SSL-сертификатов (необязательные)
+SSL_PROBE_CONCURRENCY = config.getint('SSL', 'PROBE_CONCURRENCY', fallback=100)
+SSL_CONNECT_TIMEOUT = config.getfloat('SSL', 'CONNECT_TIMEOUT', fallback=5)
+SSL_HANDSHAKE_TIMEOUT = config.getfloat('SSL', 'HANDSHAKE_TIMEOUT', fallback=5)
+SSL_SCHEDULER_TICK = config.getint('SSL', 'SCHEDULER_TICK', fallback=60)
+SSL_DIGEST_MODE = config.getboolean('SSL', 'DIGEST_MODE', fallback=True)
+SSL_NOTIFY_CONCURRENCY = config.getint('SSL', 'NOTIFY_CONCURRENCY', fallback=10)
+SSL_PROBE_ALL_ADDRESSES = config.getboolean('SSL', 'PROBE_ALL_ADDRESSES', fallback=False)
+SSL_DNS_CACHE_TTL = config.getint('SSL', 'DNS_CACHE_TTL', fallback=300)
+SSL_SWEEP_MODE = config.get('SSL', 'SWEEP_MODE', fallback='adaptive').strip().lower()
+SSL_ROLLING_INTERVAL = config.getint('SSL', 'ROLLING_INTERVAL', fallback=720)
+
+# Проверка файлов сертификатов на серверах бота (необязательная): каталоги и файлы через запятую
+CERT_FILES_PATHS = [
+    path.strip() for path in config.get('CertificateFiles', 'PATHS', fallback='').split(',') if path.strip()
+]
+CERT_FILES_EXTENSIONS = tuple(
+    extension.strip().lower()
+    for extension in config.get('CertificateFiles', 'EXTENSIONS', fallback='.pem, .crt, .cer, .der').split(',')
+    if extension.strip()
+)
+CERT_FILES_SCAN_INTERVAL = config.getint('CertificateFiles', 'SCAN_INTERVAL', fallback=3600)
+CERT_FILES_WORKERS = config.getint('CertificateFiles', 'WORKERS', fallback=0)
+
+# Политики напоминаний по лицензиям (необязательные): [Reminders] — политика по умолчанию,
+# [Reminders:<тип уведомления>] и [Reminders:company:<компания>] — отдельные политики
+REMINDER_POLICIES = {
+    section: dict(config.items(section))
+    for section in config.sections()
+    if section == 'Reminders' or section.startswith('Reminders:')
+}
+
+# Производственный календарь: праздники и перенесенные рабочие дни
+PRODUCTION_CALENDAR_PATH = config.get('Reminders', 'CALENDAR_PATH', fallback='production_calendar.txt')
@@ -20,16 +20,45 @@ from telegram.ext import (
     ContextTypes,
     filters,
 )
-from bot_config import TOKEN, ADMIN_ID, DB_PATH
+from bot_config import (
+    TOKEN,
+    ADMIN_ID,
+    DB_PATH,
+    SSL_SCHEDULER_TICK,
+    CERT_FILES_PATHS,
+    CERT_FILES_SCAN_INTERVAL,
+    SEND_RATE_GLOBAL,
+    SEND_RATE_PRIVATE_CHAT,
+    SEND_RATE_GROUP_CHAT_PER_MINUTE,
+    SEND_MAX_RETRIES,
+)
 from database_manager import (
+    init_db,
+    load_acl_cache,
+    to_day_number,
+    from_day_number,
+    STREAM_BATCH_SIZE,
+)
+from async_database import (
     save_notification_to_db,
+    notification_exists,
+    import_notifications,
+    export_notifications_csv,
     delete_notification_from_db,
-    get_notifications_from_db,
-    add_monitored_site,
+    iter_notifications,
+    get_notifications_page,
+    schedule_reminders,
+    reset_sending_reminders,
+    clear_pending_reminders,
+    skip_superseded_reminders,
+    get_due_reminders,
+    get_next_reminder_due,
+    claim_reminder,
+    mark_reminder_sent,
+    release_reminder,
     add_monitored_sites,
-    get_monitored_sites,
     remove_monitored_site,
-    init_db,
+    get_site_by_id,
     add_allowed_user,
     is_user_allowed,
     add_access_request,
@@ -37,16 +66,33 @@ from database_manager import (
     is_access_request_pending,
     get_access_request_info,
     update_certificate_info,
-    get_certificate_info,
+    get_sites_page,
     add_allowed_chat,
     is_chat_allowed,
+    close as close_async_database,
 )
 from datetime import datetime, timedelta, time
 import pytz
 import re
 import sys
-from ssl_certificate_checker import check_certificates
-from urllib.parse import urlparse
+from ssl_certificate_checker import (
+    start_full_sweep,
+    check_due_certificates,
+    unschedule_site_check,
+    probe_new_sites,
+    parse_site_address,
+    count_sites_in_backoff,
+    PROBE_DOWN,
+)
+from certificate_file_scanner import scan_certificate_files
+from message_queue import OutboundRateLimiter, PRIORITY_NORMAL
+from license_reminders import (
+    get_reminder_policy,
+    get_license_reminders,
+    get_reminder_instant,
+    build_reminder_rows,
+)
+from license_csv import parse_licenses_csv, MAX_REPORTED_ERRORS
 from git import Repo, GitCommandError
 
 # Настройки логирования
@@ -59,20 +105,16 @@ logger = logging.getLogger(__name__)
 
 # Настройки бота
 TIMEZONE = pytz.timezone("Asia/Yekaterinburg")
-
-# Инициализация базы данных при запуске
-init_db()
-
-
-def adjust_for_weekend(date):
-    # Если дата приходится на субботу или воскресенье, переносим на предыдущий рабочий день (пятницу)
-    weekday = date.weekday()
-    if weekday == 5:  # Суббота
-        return date - timedelta(days=1)
-    elif weekday == 6:  # Воскресенье
-        return date - timedelta(days=2)
-    else:
-        return date
+# Повторная попытка отправки напоминания после ошибки
+REMINDER_RETRY_INTERVAL = timedelta(minutes=10)
+# Сколько записей показывать на одной странице списков сайтов и уведомлений
+LIST_PAGE_SIZE = 10
+# Бот может скачать из Telegram файл размером не больше 20 МБ
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+# Сколько сайтов перечислять в ответе при добавлении, остальные только считаются
+MAX_LISTED_SITES = 20
+# Как часто (в секундах) обновлять сообщение о ходе проверки новых сайтов
+PROGRESS_EDIT_INTERVAL = 3
 
 
 async def send_license_notification(
@@ -83,7 +125,7 @@ async def send_license_notification(
     )
     if quantity:
         message += f" Количество: {quantity}."
-    await context.bot.send_message(chat_id=user_id, text=message)
+    await context.bot.send_message(chat_id=user_id, text=message, rate_limit_args=PRIORITY_NORMAL)
 
 
 def get_current_version():
@@ -109,7 +151,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     user_id = update.effective_user.id
 
-    if is_user_allowed(user_id) or user_id == ADMIN_ID:
+    if await is_user_allowed(user_id) or user_id == ADMIN_ID:
         version = get_current_version()
         keyboard = [
             [KeyboardButton("Запланировать уведомление")],
@@ -129,6 +171,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "- Учет выходных: уведомления переносятся на ближайший рабочий день.\n"
             "- Напоминание в день окончания срока.\n"
             "- Мгновенное напоминание, если срок уже истек.\n"
+            "- Импорт лицензий из CSV-файла и выгрузка командой /export_licenses.\n"
             "- Просмотр и управление списком сайтов для мониторинга SSL-сертификатов.",
             reply_markup=reply_markup,
         )
@@ -141,21 +184,21 @@ async def request_access(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = user.id
 
     # Проверяем, не был ли запрос уже отправлен
-    if is_access_request_pending(user_id):
+    if await is_access_request_pending(user_id):
         await update.message.reply_text(
             "Ваш запрос на доступ уже отправлен и ожидает рассмотрения."
         )
         return
 
     # Проверяем, не является ли пользователь уже одобренным
-    if is_user_allowed(user_id):
+    if await is_user_allowed(user_id):
         await update.message.reply_text(
             "У вас уже есть доступ. Введите /start для начала работы."
         )
         return
 
     # Добавляем запрос в базу данных
-    add_access_request(user_id, user.username, user.first_name, user.last_name)
+    await add_access_request(user_id, user.username, user.first_name, user.last_name)
     logger.info(f"Пользователь {user.first_name} {user.last_name} ({user.id}) запросил доступ.")
 
     await update.message.reply_text(
@@ -184,11 +227,11 @@ async def handle_approval(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = int(user_id)
     if action == 'approve':
         # Получаем информацию о пользователе из базы данных
-        result = get_access_request_info(user_id)
+        result = await get_access_request_info(user_id)
         if result:
             username, first_name, last_name = result
-            add_allowed_user(user_id, username, first_name, last_name)
-            remove_access_request(user_id)
+            await add_allowed_user(user_id, username, first_name, last_name)
+            await remove_access_request(user_id)
             await context.bot.send_message(
                 chat_id=user_id,
                 text="Ваш запрос на доступ одобрен. Введите /start для начала работы.",
@@ -197,7 +240,7 @@ async def handle_approval(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             await query.answer("Запрос пользователя не найден.")
     elif action == 'reject':
-        remove_access_request(user_id)
+        await remove_access_request(user_id)
         await context.bot.send_message(
             chat_id=user_id, text="Ваш запрос на доступ отклонен."
         )
@@ -219,7 +262,8 @@ async def schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Название компании\n"
         "Продукт\n"
         "Дата истечения срока (ДД.ММ.ГГГГ)\n"
-        "Количество (опционально)"
+        "Количество (опционально)\n\n"
+        "Или отправьте CSV-файл со столбцами: компания, продукт, дата истечения, количество."
     )
     context.user_data['awaiting_license_data'] = True
 
@@ -273,39 +317,19 @@ async def process_license_data(update: Update, context: ContextTypes.DEFAULT_TYP
         return
 
     # Проверяем, не существует ли уже уведомление для этой компании и продукта
-    notifications = get_notifications_from_db()
-    for notif in notifications:
-        if notif[2] == company and notif[3] == product:
-            await update.message.reply_text(
-                f"Уведомление для компании '{company}' и продукта '{product}' уже существует. "
-                "Проверьте список уведомлений или измените данные.\n"
-                "Введите данные о лицензии в указанном формате:"
-            )
-            return
+    if await notification_exists(company, product):
+        await reply_duplicate_notification(update, company, product)
+        return
 
-    # Планируем уведомления
-    notify_dates = []
-
-    # Уведомление за 7 дней
-    notify_date_7_days = expiry_date - timedelta(days=7)
-    notify_date_7_days = adjust_for_weekend(notify_date_7_days)
-
-    # Проверяем, что уведомление за 7 дней еще не прошло
-    if notify_date_7_days > current_date:
-        notify_dates.append(notify_date_7_days)
-    elif notify_date_7_days == current_date:
-        # Проверяем время (уведомление в 09:00)
-        current_time = datetime.now(TIMEZONE).time()
-        if current_time < time(9, 0):
-            notify_dates.append(notify_date_7_days)
-
-    # Уведомление в день истечения
-    if expiry_date > current_date:
-        notify_dates.append(expiry_date)
-    elif expiry_date == current_date:
-        current_time = datetime.now(TIMEZONE).time()
-        if current_time < time(9, 0):
-            notify_dates.append(expiry_date)
+    # Планируем уведомления: напоминания, время которых уже прошло, не отправляются
+    now = datetime.now(TIMEZONE)
+    notification_type = 'лицензия'  # Тип уведомления всегда 'лицензия' для этой функции
+    policy = get_reminder_policy(company, notification_type)
+    notify_dates = [
+        date
+        for kind, date in get_license_reminders(expiry_date, policy)
+        if kind != 'expired' and get_reminder_instant(date, policy) > now
+    ]
 
     if not notify_dates:
         await update.message.reply_text(
@@ -314,26 +338,129 @@ async def process_license_data(update: Update, context: ContextTypes.DEFAULT_TYP
         return
 
     # Сохраняем уведомление в базе данных
-    success = save_notification_to_db(
+    notif_id = await save_notification_to_db(
         update.effective_user.id,  # user_id
         company,
         product,
-        expiry_date.strftime('%Y-%m-%d'),
+        to_day_number(expiry_date),
         '',  # notify_date будет рассчитана при проверке уведомлений
         quantity,
-        'лицензия',  # Тип уведомления всегда 'лицензия' для этой функции
+        notification_type,
+    )
+
+    if not notif_id:
+        # Такое же уведомление успели сохранить параллельно
+        await reply_duplicate_notification(update, company, product)
+        return
+
+    # Прошедшие напоминания сразу отмечаются пропущенными, чтобы они не были отправлены задним числом
+    await schedule_reminders(
+        build_reminder_rows(notif_id, company, notification_type, expiry_date, skip_before=now)
+    )
+    await arm_license_timer(context.job_queue)
+
+    messages = []
+    for date in notify_dates:
+        messages.append(f"- {date.strftime('%d.%m.%Y')} в {policy.send_time.strftime('%H:%M')}")
+    await update.message.reply_text(
+        "Уведомления запланированы на следующие даты:\n" + "\n".join(messages)
     )
+    context.user_data.pop('awaiting_license_data', None)
+
 
-    if success:
-        messages = []
-        for date in notify_dates:
-            messages.append(f"- {date.strftime('%d.%m.%Y')} в 09:00")
+async def handle_license_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat = update.effective_chat
+    if chat.type != 'private':
+        await update.message.reply_text("Пожалуйста, используйте личный чат для взаимодействия со мной.")
+        return
+
+    user_id = update.effective_user.id
+    if not await is_user_allowed(user_id) and user_id != ADMIN_ID:
+        await request_access(update, context)
+        return
+
+    # CSV принимается только в ответ на запрос 'Запланировать уведомление'
+    if not context.user_data.get('awaiting_license_data'):
         await update.message.reply_text(
-            "Уведомления запланированы на следующие даты:\n" + "\n".join(messages)
+            "Файл не ожидался. Чтобы импортировать лицензии из CSV, нажмите 'Запланировать уведомление' "
+            "и затем отправьте файл."
         )
-    else:
-        await update.message.reply_text("Не удалось сохранить уведомление. Попробуйте снова.")
-    context.user_data.pop('awaiting_license_data', None)
+        return
+
+    document = update.message.document
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await update.message.reply_text("Файл слишком большой. Максимальный размер — 20 МБ.")
+        return
+    context.user_data.clear()
+
+    file = await document.get_file()
+    data = bytes(await file.download_as_bytearray())
+    # Разбор и проверка файла выполняются вне цикла событий
+    try:
+        notifications, duplicates, errors = await asyncio.get_running_loop().run_in_executor(
+            None, parse_licenses_csv, data, datetime.now(TIMEZONE).date()
+        )
+    except UnicodeDecodeError:
+        await update.message.reply_text("Не удалось прочитать файл. Сохраните CSV в кодировке UTF-8.")
+        return
+
+    notification_type = 'лицензия'
+    inserted = []
+    if notifications:
+        inserted = await import_notifications(user_id, notifications, notification_type)
+
+    now = datetime.now(TIMEZONE)
+    reminders = []
+    for notif_id, company, expiry_day in inserted:
+        reminders.extend(
+            build_reminder_rows(
+                notif_id, company, notification_type, from_day_number(expiry_day), skip_before=now
+            )
+        )
+    if reminders:
+        await schedule_reminders(reminders)
+        await arm_license_timer(context.job_queue)
+
+    skipped = duplicates + len(notifications) - len(inserted)
+    logger.info(
+        f"Импорт лицензий от {user_id}: добавлено {len(inserted)}, пропущено {skipped}, ошибок {len(errors)}"
+    )
+    message = (
+        "Импорт завершен.\n"
+        f"Добавлено: {len(inserted)}\n"
+        f"Пропущено (уже существуют или повторяются в файле): {skipped}\n"
+        f"С ошибками: {len(errors)}"
+    )
+    if errors:
+        message += "\n\n" + "\n".join(errors[:MAX_REPORTED_ERRORS])
+        if len(errors) > MAX_REPORTED_ERRORS:
+            message += f"\n... и еще {len(errors) - MAX_REPORTED_ERRORS}"
+    await update.message.reply_text(message)
+
+
+async def export_licenses_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat = update.effective_chat
+    if chat.type != 'private':
+        await update.message.reply_text("Пожалуйста, используйте личный чат для взаимодействия со мной.")
+        return
+
+    user_id = update.effective_user.id
+    if not await is_user_allowed(user_id) and user_id != ADMIN_ID:
+        await request_access(update, context)
+        return
+
+    # Файл формируется в потоке чтения базы, не блокируя цикл событий
+    data = await export_notifications_csv()
+    filename = f"licenses_{datetime.now(TIMEZONE).strftime('%Y%m%d')}.csv"
+    await update.message.reply_document(document=data, filename=filename)
+
+
+async def reply_duplicate_notification(update, company, product):
+    await update.message.reply_text(
+        f"Уведомление для компании '{company}' и продукта '{product}' уже существует. "
+        "Проверьте список уведомлений или измените данные.\n"
+        "Введите данные о лицензии в указанном формате:"
+    )
 
 
 async def list_scheduled(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -342,13 +469,35 @@ async def list_scheduled(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Пожалуйста, используйте личный чат для взаимодействия со мной.")
         return
 
-    notifications = get_notifications_from_db()
-    if not notifications:
+    message, reply_markup = await render_notifications_page()
+    if message is None:
         await update.message.reply_text("Нет запланированных уведомлений.")
         return
+    await update.message.reply_text(message, reply_markup=reply_markup)
+
+
+def parse_page_cursor(data):
+    # callback_data кнопок листания: '<префикс>|<направление>|<ключ сортировки>|<id>'
+    _, direction, sort_key, row_id = data.split('|', 3)
+    return direction, (int(sort_key), int(row_id))
+
+
+def build_page_buttons(prefix, first_cursor, last_cursor, has_prev, has_next):
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("« Назад", callback_data=f"{prefix}|<|{first_cursor[0]}|{first_cursor[1]}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Вперед »", callback_data=f"{prefix}|>|{last_cursor[0]}|{last_cursor[1]}"))
+    return buttons
+
+
+async def render_notifications_page(after=None, before=None):
+    notifications, has_more = await get_notifications_page(after, before, LIST_PAGE_SIZE)
+    if not notifications:
+        return None, None
     message = "Список запланированных уведомлений:\n"
     for notif in notifications:
-        expiry_date = datetime.strptime(notif[4], '%Y-%m-%d').strftime('%d.%m.%Y')
+        expiry_date = from_day_number(notif[4]).strftime('%d.%m.%Y')
         quantity_info = f"Количество: {notif[6]}" if notif[6] else ""
         message += (
             f"{notif[0]}. Клиент: {notif[2]}\n"
@@ -357,7 +506,33 @@ async def list_scheduled(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Истекает: {expiry_date}\n"
             f"Команда для удаления: /delete_{notif[0]}\n\n"
         )
-    await update.message.reply_text(message)
+    has_prev = has_more if before is not None else after is not None
+    has_next = has_more if before is None else True
+    buttons = build_page_buttons(
+        'licenses_page',
+        (notifications[0][4], notifications[0][0]),
+        (notifications[-1][4], notifications[-1][0]),
+        has_prev,
+        has_next,
+    )
+    return message, InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+async def handle_notifications_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    direction, cursor = parse_page_cursor(query.data)
+    if direction == '>':
+        message, reply_markup = await render_notifications_page(after=cursor)
+    else:
+        message, reply_markup = await render_notifications_page(before=cursor)
+    if message is None:
+        # Записи страницы успели удалить: показываем список с начала
+        message, reply_markup = await render_notifications_page()
+    await query.answer()
+    if message is None:
+        await query.edit_message_text("Нет запланированных уведомлений.")
+        return
+    await query.edit_message_text(message, reply_markup=reply_markup)
 
 
 async def delete_notification(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -370,7 +545,7 @@ async def delete_notification(update: Update, context: ContextTypes.DEFAULT_TYPE
     match = re.match(r'^/delete_(\d+)$', message_text)
     if match:
         notif_id = match.group(1)
-        delete_notification_from_db(notif_id)
+        await delete_notification_from_db(notif_id)
         await update.message.reply_text(f"Уведомление с ID {notif_id} удалено.")
     else:
         await update.message.reply_text(
@@ -384,46 +559,78 @@ async def list_sites(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Пожалуйста, используйте личный чат для взаимодействия со мной.")
         return
 
-    sites = get_monitored_sites()
-    if not sites:
+    message, reply_markup = await render_sites_page()
+    if message is None:
         await update.message.reply_text("Список сайтов для мониторинга пуст.")
         return
+    await update.message.reply_text(message, reply_markup=reply_markup)
+
+
+async def render_sites_page(after=None, before=None):
+    sites, has_more = await get_sites_page(after, before, LIST_PAGE_SIZE)
+    if not sites:
+        return None, None
 
     message = "Список сайтов, за которыми ведется наблюдение:\n\n"
     buttons = []
-
-    for site in sites:
-        cert_info = get_certificate_info(site)
-        if cert_info and cert_info['expiry_date']:
-            expiry_date = datetime.strptime(
-                cert_info['expiry_date'], '%Y-%m-%d %H:%M:%S'
-            )
-            days_to_expiry = (expiry_date.date() - datetime.now(TIMEZONE).date()).days
+    today = datetime.now(TIMEZONE).date()
+
+    for site_id, site, expiry_at, common_name, _, probe_state in sites:
+        if probe_state == PROBE_DOWN:
+            message += f"⚠️ Сайт {site} недоступен, повторные проверки отложены.\n"
+        if expiry_at:
+            expiry_date = datetime.fromtimestamp(expiry_at, TIMEZONE)
+            days_to_expiry = (expiry_date.date() - today).days
             message += (
                 f"Сайт: {site}\n"
-                f"CN: {cert_info['common_name']}\n"
+                f"CN: {common_name}\n"
                 f"Сертификат истекает: {expiry_date.strftime('%d.%m.%Y %H:%M:%S')} "
                 f"(через {days_to_expiry} дней)\n\n"
             )
         else:
             message += f"Сайт: {site}\nИнформация о сертификате отсутствует. Нажмите 'Обновить информацию о сайтах'.\n\n"
-        # Добавляем кнопку удаления для каждого сайта
+        # Добавляем кнопку удаления для каждого сайта. В данных кнопки — id сайта:
+        # Telegram ограничивает callback_data 64 байтами, а адрес сайта может быть длиннее
         buttons.append(
-            [InlineKeyboardButton(f"Удалить {site}", callback_data=f"delete_site|{site}")]
+            [InlineKeyboardButton(f"Удалить {site}", callback_data=f"delete_site|{site_id}")]
         )
 
-    reply_markup = InlineKeyboardMarkup(buttons)
-    await update.message.reply_text(message, reply_markup=reply_markup)
+    has_prev = has_more if before is not None else after is not None
+    has_next = has_more if before is None else True
+    page_buttons = build_page_buttons(
+        'sites_page', (sites[0][4], sites[0][0]), (sites[-1][4], sites[-1][0]), has_prev, has_next
+    )
+    if page_buttons:
+        buttons.append(page_buttons)
+    return message, InlineKeyboardMarkup(buttons)
+
+
+async def handle_sites_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    direction, cursor = parse_page_cursor(query.data)
+    if direction == '>':
+        message, reply_markup = await render_sites_page(after=cursor)
+    else:
+        message, reply_markup = await render_sites_page(before=cursor)
+    if message is None:
+        # Сайты страницы успели удалить: показываем список с начала
+        message, reply_markup = await render_sites_page()
+    await query.answer()
+    if message is None:
+        await query.edit_message_text("Список сайтов для мониторинга пуст.")
+        return
+    await query.edit_message_text(message, reply_markup=reply_markup)
 
 
 async def handle_delete_site_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     data = query.data
     if data.startswith('delete_site|'):
-        site = data.split('|', 1)[1]
-        sites = get_monitored_sites()
-        if site.lower() in [s.lower() for s in sites]:
-            remove_monitored_site(site)
+        site_id = data.split('|', 1)[1]
+        site = await get_site_by_id(int(site_id)) if site_id.isdigit() else None
+        if site is not None:
+            await remove_monitored_site(site)
+            unschedule_site_check(site)
             await query.answer(f"Сайт {site} удален из списка мониторинга.")
             await query.edit_message_text(f"Сайт {site} был удален из списка мониторинга.")
         else:
@@ -438,13 +645,42 @@ async def update_sites_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Пожалуйста, используйте личный чат для взаимодействия со мной.")
         return
 
-    await update.message.reply_text(
+    # Проверка идет в фоне, обработчик сразу освобождается
+    status_message = await update.message.reply_text(
         "Обновление информации о сертификатах. Пожалуйста, подождите..."
     )
-    await check_certificates(context)
-    await update.message.reply_text("Информация о сертификатах обновлена.")
-    # После обновления выводим список сайтов
-    await list_sites(update, context)
+    if not start_full_sweep(context, make_sweep_listener(status_message)):
+        await status_message.edit_text(
+            "Обновление информации о сертификатах уже выполняется, результаты будут показаны здесь."
+        )
+
+
+def make_sweep_listener(status_message):
+    loop = asyncio.get_running_loop()
+    last_edit = loop.time()
+
+    async def listener(checked, failed, total, finished):
+        nonlocal last_edit
+        if not finished:
+            if loop.time() - last_edit < PROGRESS_EDIT_INTERVAL:
+                return
+            last_edit = loop.time()
+            await edit_status_message(
+                status_message,
+                f"Обновление информации о сертификатах: {checked} из {total}, с ошибками: {failed}",
+            )
+            return
+        summary = f"Информация о сертификатах обновлена: проверено {checked} из {total}, с ошибками: {failed}."
+        in_backoff = count_sites_in_backoff()
+        if in_backoff:
+            summary += f"\nОтложено после ошибок: {in_backoff}."
+        await edit_status_message(status_message, summary)
+        # После обновления выводим список сайтов
+        message, reply_markup = await render_sites_page()
+        if message is not None:
+            await status_message.reply_text(message, reply_markup=reply_markup)
+
+    return listener
 
 
 async def add_site_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -455,7 +691,10 @@ async def add_site_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     context.user_data.clear()  # Очищаем данные, чтобы избежать конфликтов
     await update.message.reply_text(
-        "Введите адрес сайта или список сайтов, которые вы хотите добавить для мониторинга SSL-сертификата. Каждый сайт с новой строки:"
+        "Введите адрес сайта или список сайтов, которые вы хотите добавить для мониторинга SSL-сертификата. Каждый сайт с новой строки.\n"
+        "Можно указать порт (example.com:8443) и протокол: smtps://, imaps://, pop3s://, ldaps:// "
+        "или STARTTLS — smtp://, imap://, pop3://, postgres://.\n"
+        "Можно также отправить текстовый файл (.txt) со списком сайтов:"
     )
     context.user_data['adding_site'] = True
 
@@ -479,34 +718,129 @@ async def process_add_site(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_message(update, context)
         return
 
-    sites = sites_input.split('\n')
-    normalized_sites = []
-    for site in sites:
-        site = site.strip()
-        if not site:
+    await onboard_sites(update, context, sites_input.split('\n'))
+    context.user_data.pop('adding_site', None)
+
+
+async def handle_site_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat = update.effective_chat
+    if chat.type != 'private':
+        await update.message.reply_text("Пожалуйста, используйте личный чат для взаимодействия со мной.")
+        return
+
+    user_id = update.effective_user.id
+    if not await is_user_allowed(user_id) and user_id != ADMIN_ID:
+        await request_access(update, context)
+        return
+
+    # Файл принимается только в ответ на запрос 'Добавить сайт': иначе каждое слово
+    # случайного текстового файла стало бы сайтом для проверки
+    if not context.user_data.get('adding_site'):
+        await update.message.reply_text(
+            "Файл не ожидался. Чтобы добавить сайты из файла, нажмите 'Добавить сайт' и затем отправьте файл."
+        )
+        return
+
+    document = update.message.document
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await update.message.reply_text("Файл слишком большой. Максимальный размер — 20 МБ.")
+        return
+    context.user_data.clear()
+
+    file = await document.get_file()
+    try:
+        text = (await file.download_as_bytearray()).decode('utf-8-sig')
+    except UnicodeDecodeError:
+        await update.message.reply_text("Не удалось прочитать файл. Сохраните его в кодировке UTF-8.")
+        return
+    await onboard_sites(update, context, text.splitlines())
+
+
+def normalize_sites(lines):
+    # Один проход: нормализация, проверка и удаление повторов.
+    # Возвращает (уникальные ключи сайтов, нераспознанные строки, число повторов)
+    sites = []
+    seen = set()
+    invalid = []
+    duplicates = 0
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        # Ключ сайта — каноническая запись хоста, порта и протокола
+        address = parse_site_address(line)
+        if address is None:
+            invalid.append(line)
             continue
-        # Нормализуем сайт
-        if not re.match(r'^https?://', site):
-            site = 'https://' + site
-        parsed_url = urlparse(site)
-        hostname = parsed_url.hostname or parsed_url.path
-        normalized_site = hostname.lower()
-        normalized_sites.append(normalized_site)
-
-    # Добавляем сайты
-    added_sites, failed_sites = add_monitored_sites(normalized_sites)
+        site = address.site.lower()
+        if site in seen:
+            duplicates += 1
+            continue
+        seen.add(site)
+        sites.append(site)
+    return sites, invalid, duplicates
+
+
+def format_site_list(title, sites):
+    message = f"{title}\n"
+    for site in sites[:MAX_LISTED_SITES]:
+        message += f"- {site}\n"
+    if len(sites) > MAX_LISTED_SITES:
+        message += f"... и еще {len(sites) - MAX_LISTED_SITES}\n"
+    return message
+
+
+async def onboard_sites(update, context, lines):
+    sites, invalid, duplicates = normalize_sites(lines)
+
+    # Добавляем сайты одной транзакцией
+    added_sites, existing_sites = await add_monitored_sites(sites) if sites else ([], [])
     message = ""
     if added_sites:
-        message += "Следующие сайты были успешно добавлены для мониторинга:\n"
-        for site in added_sites:
-            message += f"- {site}\n"
-    if failed_sites:
-        message += "Следующие сайты не были добавлены (возможно, уже существуют):\n"
-        for site in failed_sites:
-            message += f"- {site}\n"
+        message += format_site_list("Следующие сайты были успешно добавлены для мониторинга:", added_sites)
+    if existing_sites:
+        message += format_site_list("Следующие сайты не были добавлены (уже существуют):", existing_sites)
+    if invalid:
+        message += format_site_list("Не удалось распознать адреса:", invalid)
+    if duplicates:
+        message += f"Повторяющихся строк пропущено: {duplicates}\n"
+    await update.message.reply_text(message or "Список сайтов пуст.")
 
-    await update.message.reply_text(message)
-    context.user_data.pop('adding_site', None)
+    if added_sites:
+        # Новые сайты проверяем сразу, ход проверки показываем в одном сообщении
+        status_message = await update.message.reply_text(
+            f"Проверка сертификатов новых сайтов: 0 из {len(added_sites)}"
+        )
+        context.application.create_task(probe_added_sites(context, status_message, added_sites))
+
+
+async def probe_added_sites(context, status_message, sites):
+    loop = asyncio.get_running_loop()
+    last_edit = loop.time()
+
+    async def report_progress(checked, failed):
+        nonlocal last_edit
+        if loop.time() - last_edit < PROGRESS_EDIT_INTERVAL:
+            return
+        last_edit = loop.time()
+        await edit_status_message(
+            status_message,
+            f"Проверка сертификатов новых сайтов: {checked} из {len(sites)}, с ошибками: {failed}",
+        )
+
+    checked, failed = await probe_new_sites(sites, context, report_progress)
+    await edit_status_message(
+        status_message,
+        f"Проверка сертификатов новых сайтов завершена: {checked} из {len(sites)}, с ошибками: {failed}.\n"
+        "Результаты — в списке сайтов.",
+    )
+
+
+async def edit_status_message(message, text):
+    try:
+        await message.edit_text(text)
+    except Exception as e:
+        logger.warning(f"Не удалось обновить сообщение о ходе проверки: {e}")
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -518,7 +852,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Пожалуйста, используйте личный чат для взаимодействия со мной.")
         return
 
-    if not is_user_allowed(user_id) and user_id != ADMIN_ID:
+    if not await is_user_allowed(user_id) and user_id != ADMIN_ID:
         await request_access(update, context)
         return
 
@@ -558,10 +892,29 @@ async def approve_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if user.id != ADMIN_ID:
         await update.message.reply_text("У вас нет прав для выполнения этой команды.")
         return
-    add_allowed_chat(chat.id)
+    await add_allowed_chat(chat.id)
     await update.message.reply_text("Этот чат успешно одобрен для получения уведомлений.")
 
 
+async def queue_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if user.id != ADMIN_ID:
+        await update.message.reply_text("У вас нет прав для выполнения этой команды.")
+        return
+
+    stats = context.bot.rate_limiter.get_stats()
+    queued = stats['queued']
+    await update.message.reply_text(
+        "Очередь исходящих сообщений:\n"
+        f"Ожидают отправки: {sum(queued.values())} "
+        f"(ответы: {queued[0]}, напоминания: {queued[1]}, рассылки: {queued[2]})\n"
+        f"Отправлено: {stats['sent']}\n"
+        f"Повторов: {stats['retries']}\n"
+        f"Ошибок: {stats['failed']}\n"
+        f"Задержка: в среднем {stats['average_latency']:.2f} с, максимум {stats['max_latency']:.2f} с"
+    )
+
+
 async def update_bot_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if user.id != ADMIN_ID:
@@ -642,68 +995,140 @@ def register_handlers(application):
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("approve_chat", approve_chat))
     application.add_handler(CommandHandler("update_bot", update_bot_command))
+    application.add_handler(CommandHandler("queue_stats", queue_stats_command))
+    application.add_handler(CommandHandler("export_licenses", export_licenses_command))
     application.add_handler(CallbackQueryHandler(handle_approval, pattern='^(approve|reject)_'))
     application.add_handler(CallbackQueryHandler(update_bot_callback, pattern='^update_bot$'))
     application.add_handler(CallbackQueryHandler(handle_delete_site_callback, pattern='^delete_site\|'))
+    application.add_handler(CallbackQueryHandler(handle_sites_page_callback, pattern='^sites_page\|'))
+    application.add_handler(
+        CallbackQueryHandler(handle_notifications_page_callback, pattern='^licenses_page\|')
+    )
     application.add_handler(MessageHandler(filters.Regex(r'^/delete_\d+$'), delete_notification))
+    application.add_handler(
+        MessageHandler(filters.Document.FileExtension('csv'), handle_license_import)
+    )
+    application.add_handler(MessageHandler(filters.Document.FileExtension('txt'), handle_site_import))
     application.add_handler(MessageHandler(filters.ALL, handle_message))
 
 
 def schedule_license_checks(application):
-    # Запланировать регулярную проверку лицензий
-    application.job_queue.run_repeating(
-        check_licenses,
-        interval=60 * 60,  # Проверка каждый час
-        first=10,  # Первое выполнение через 10 секунд после запуска бота
-    )
+    # Первая проверка через 10 секунд после запуска: пересчитывает расписание напоминаний,
+    # отправляет пропущенные и взводит таймер на ближайшее напоминание
+    application.job_queue.run_once(check_licenses, when=10)
 
 
-async def check_licenses(context: ContextTypes.DEFAULT_TYPE):
-    logger.info("Проверка запланированных уведомлений по лицензиям")
-    notifications = get_notifications_from_db()
-    current_date = datetime.now(TIMEZONE).date()
-    current_time = datetime.now(TIMEZONE).time()
+# Единственный таймер очереди заданий, взведенный на время ближайшего напоминания
+_license_timer = None
+_reminders_synced = False
 
-    for notif in notifications:
-        (
-            notif_id,
-            user_id,
-            company,
-            product,
-            expiry_date_str,
-            notify_date_str,
-            quantity,
-            notification_type,
-        ) = notif
-        expiry_date = datetime.strptime(expiry_date_str, '%Y-%m-%d').date()
-        # Вычисляем дату уведомления за 7 дней
-        notify_date = adjust_for_weekend(expiry_date - timedelta(days=7))
-
-        send_notification = False
-
-        if current_date == notify_date:
-            if time(9, 0) <= current_time < time(10, 0):
-                send_notification = True
-        elif current_date == expiry_date:
-            if time(9, 0) <= current_time < time(10, 0):
-                send_notification = True
-        elif current_date > expiry_date:
-            send_notification = True
-            message = (
-                f"Срок действия лицензии для компании '{company}' на продукт '{product}' "
-                f"истек {expiry_date.strftime('%d.%m.%Y')}."
-            )
-            if quantity:
-                message += f" Количество: {quantity}."
-            await context.bot.send_message(chat_id=user_id, text=message)
-            logger.info(f"Отправлено уведомление об истечении для {company} - {product}")
-            continue  # Переходим к следующему уведомлению
-
-        if send_notification:
-            await send_license_notification(
-                context, user_id, company, product, expiry_date, quantity
+
+async def arm_license_timer(job_queue):
+    global _license_timer
+    next_due = await get_next_reminder_due()
+    if _license_timer is not None:
+        _license_timer.schedule_removal()
+        _license_timer = None
+    if next_due is None:
+        return
+    delay = max(next_due - datetime.now(TIMEZONE).timestamp(), 0)
+    _license_timer = job_queue.run_once(check_licenses, when=delay)
+
+
+async def sync_license_reminders():
+    # Даты истечения разбираются один раз при запуске, расписание строится по текущим политикам.
+    # Уведомления читаются и записываются пакетами, таблица целиком в память не загружается
+    global _reminders_synced
+    # Флаг ставится сразу, чтобы параллельная проверка не пересчитала расписание повторно
+    _reminders_synced = True
+    try:
+        # Прерванные отправки пересчитываются вместе с ожидающими напоминаниями
+        await reset_sending_reminders()
+        await clear_pending_reminders()
+        reminders = []
+        async for notif in iter_notifications():
+            reminders.extend(
+                build_reminder_rows(
+                    notif.id, notif.company, notif.notification_type, from_day_number(notif.expiry_day)
+                )
             )
-            logger.info(f"Отправлено уведомление для {company} - {product}")
+            if len(reminders) >= STREAM_BATCH_SIZE:
+                await schedule_reminders(reminders)
+                reminders = []
+        if reminders:
+            await schedule_reminders(reminders)
+        await skip_superseded_reminders()
+    except Exception:
+        # Расписание пересчитывается заново при следующей проверке
+        _reminders_synced = False
+        raise
+
+
+async def check_licenses(context: ContextTypes.DEFAULT_TYPE):
+    global _license_timer
+    # Эта проверка и есть сработавший таймер
+    _license_timer = None
+    try:
+        if not _reminders_synced:
+            await sync_license_reminders()
+
+        logger.info("Проверка запланированных уведомлений по лицензиям")
+        now = datetime.now(TIMEZONE)
+        due = {}
+        for row in await get_due_reminders(int(now.timestamp())):
+            notif_id, kind, due_day, user_id, company, product, expiry_day, quantity = row
+            info = (user_id, company, product, expiry_day, quantity)
+            due.setdefault(notif_id, (info, []))[1].append((kind, due_day))
+
+        for notif_id, (info, due_reminders) in due.items():
+            user_id, company, product, expiry_day, quantity = info
+            expiry_date = from_day_number(expiry_day)
+
+            # Более ранние пропущенные напоминания устарели: отправляем только последнее
+            for kind, due_day in due_reminders[:-1]:
+                await claim_reminder(notif_id, kind, due_day, 'skipped')
+            kind, due_day = due_reminders[-1]
+            if not await claim_reminder(notif_id, kind, due_day):
+                continue  # Напоминание уже отправлено или его отправляет другой процесс
+
+            try:
+                await send_license_reminder(
+                    context, kind, user_id, company, product, expiry_date, quantity
+                )
+            except Exception as e:
+                logger.error(f"Ошибка при отправке напоминания для {company} - {product}: {e}")
+                await release_reminder(
+                    notif_id, kind, due_day, int((now + REMINDER_RETRY_INTERVAL).timestamp())
+                )
+                continue
+            await mark_reminder_sent(notif_id, kind, due_day)
+
+        await arm_license_timer(context.job_queue)
+    except Exception:
+        # Без таймера напоминания остановились бы до добавления нового уведомления:
+        # после ошибки (например, занятой базы данных) проверка повторяется позже
+        if _license_timer is None:
+            _license_timer = context.job_queue.run_once(check_licenses, when=REMINDER_RETRY_INTERVAL)
+        raise
+
+
+async def send_license_reminder(context, kind, user_id, company, product, expiry_date, quantity):
+    if kind == 'expired':
+        message = (
+            f"Срок действия лицензии для компании '{company}' на продукт '{product}' "
+            f"истек {expiry_date.strftime('%d.%m.%Y')}."
+        )
+        if quantity:
+            message += f" Количество: {quantity}."
+        await context.bot.send_message(
+            chat_id=user_id, text=message, rate_limit_args=PRIORITY_NORMAL
+        )
+        logger.info(f"Отправлено уведомление об истечении для {company} - {product}")
+    else:
+        await send_license_notification(
+            context, user_id, company, product, expiry_date, quantity
+        )
+        logger.info(f"Отправлено уведомление для {company} - {product}")
 
 
 def schedule_update_checks(application):
@@ -749,13 +1174,35 @@ async def check_for_updates(context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=ADMIN_ID, text=f"Ошибка при проверке обновлений: {e}")
 
 
+async def close_database(application):
+    # Дописываем в базу операции, оставшиеся в очереди записи
+    await close_async_database()
+
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error(msg="Exception while handling an update:", exc_info=context.error)
 
 
 def main():
+    # Инициализация базы данных и кэша списков доступа при запуске
+    init_db()
+    load_acl_cache()
+
     # Создаем приложение бота
-    application = ApplicationBuilder().token(TOKEN).build()
+    # Все исходящие запросы проходят через общую очередь с ограничением частоты
+    rate_limiter = OutboundRateLimiter(
+        global_rate=SEND_RATE_GLOBAL,
+        private_chat_rate=SEND_RATE_PRIVATE_CHAT,
+        group_chat_rate=SEND_RATE_GROUP_CHAT_PER_MINUTE / 60,
+        max_retries=SEND_MAX_RETRIES,
+    )
+    application = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .rate_limiter(rate_limiter)
+        .post_shutdown(close_database)
+        .build()
+    )
 
     # Добавляем обработчик ошибок
     application.add_error_handler(error_handler)
@@ -766,13 +1213,22 @@ def main():
     # Запускаем проверку лицензий
     schedule_license_checks(application)
 
-    # Запускаем проверку сертификатов каждые 12 часов
+    # Запускаем планировщик проверки сертификатов: на каждом шаге проверяются только сайты,
+    # для которых наступило время следующей проверки
     application.job_queue.run_repeating(
-        check_certificates,
-        interval=12 * 60 * 60,  # Каждые 12 часов
+        check_due_certificates,
+        interval=SSL_SCHEDULER_TICK,
         first=10,  # Первое выполнение через 10 секунд после запуска бота
     )
 
+    # Запускаем проверку файлов сертификатов, если заданы каталоги
+    if CERT_FILES_PATHS:
+        application.job_queue.run_repeating(
+            scan_certificate_files,
+            interval=CERT_FILES_SCAN_INTERVAL,
+            first=30,
+        )
+
     # Запускаем планировщик проверки обновлений
     schedule_update_checks(application)
 
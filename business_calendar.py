@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# business_calendar.py
+
+import calendar
+import logging
+import os
+from datetime import date, datetime, timedelta
+from bot_config import PRODUCTION_CALENDAR_PATH
+
+# Настройки логирования
+logger = logging.getLogger(__name__)
+
+# Допустимое число рабочих дней в году календаря: защита от ошибок в файле
+MIN_WORKING_DAYS = 240
+MAX_WORKING_DAYS = 255
+
+# Нерабочие праздничные дни и рабочие дни, перенесенные на выходные
+_holidays = set()
+_workdays = set()
+# Для каждого года: bytearray по номерам дней года, на сколько дней назад
+# находится ближайший рабочий день (0 — день рабочий)
+_year_offsets = {}
+
+
+def parse_calendar(lines):
+    holidays = set()
+    workdays = set()
+    for line_number, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        try:
+            date_str, kind = line.split()
+            day = datetime.strptime(date_str, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError(f"Строка {line_number}: ожидается 'ГГГГ-ММ-ДД holiday|workday'")
+        if day in holidays or day in workdays:
+            raise ValueError(f"Строка {line_number}: дата {date_str} указана повторно")
+        if kind == 'holiday':
+            holidays.add(day)
+        elif kind == 'workday':
+            if day.weekday() < 5:
+                raise ValueError(f"Строка {line_number}: перенесенный рабочий день {date_str} не выходной")
+            workdays.add(day)
+        else:
+            raise ValueError(f"Строка {line_number}: неизвестный вид дня '{kind}'")
+    return holidays, workdays
+
+
+def validate_calendar(holidays, workdays):
+    # Каждый год календаря должен содержать правдоподобное число рабочих дней
+    for year in sorted({day.year for day in holidays | workdays}):
+        days_in_year = 366 if calendar.isleap(year) else 365
+        working_days = sum(
+            1
+            for offset in range(days_in_year)
+            if _is_working_day(date(year, 1, 1) + timedelta(days=offset), holidays, workdays)
+        )
+        if not MIN_WORKING_DAYS <= working_days <= MAX_WORKING_DAYS:
+            raise ValueError(f"В {year} году {working_days} рабочих дней, календарь заполнен с ошибками")
+
+
+def load_calendar(path=PRODUCTION_CALENDAR_PATH):
+    global _holidays, _workdays
+    if not os.path.exists(path):
+        logger.warning(f"Производственный календарь {path} не найден, учитываются только выходные")
+        holidays, workdays = set(), set()
+    else:
+        with open(path, encoding='utf-8') as f:
+            try:
+                holidays, workdays = parse_calendar(f)
+                validate_calendar(holidays, workdays)
+            except ValueError as e:
+                raise ValueError(f"Ошибка в производственном календаре {path}: {e}")
+    _holidays, _workdays = holidays, workdays
+    _year_offsets.clear()
+
+
+def _is_working_day(day, holidays, workdays):
+    if day in workdays:
+        return True
+    return day.weekday() < 5 and day not in holidays
+
+
+def _build_year_offsets(year):
+    first_day = date(year, 1, 1)
+    # Нерабочие дни в конце предыдущего года продолжают отсчет
+    run = 0
+    while not _is_working_day(first_day - timedelta(days=run + 1), _holidays, _workdays):
+        run += 1
+    offsets = bytearray()
+    for offset in range(366 if calendar.isleap(year) else 365):
+        if _is_working_day(first_day + timedelta(days=offset), _holidays, _workdays):
+            run = 0
+        else:
+            run += 1
+        offsets.append(run)
+    return offsets
+
+
+def _get_year_offsets(year):
+    offsets = _year_offsets.get(year)
+    if offsets is None:
+        offsets = _year_offsets[year] = _build_year_offsets(year)
+    return offsets
+
+
+def is_working_day(day):
+    return _get_year_offsets(day.year)[day.timetuple().tm_yday - 1] == 0
+
+
+def previous_working_day(day):
+    # Сам день, если он рабочий, иначе ближайший предшествующий рабочий день
+    return day - timedelta(days=_get_year_offsets(day.year)[day.timetuple().tm_yday - 1])
+
+
+load_calendar()
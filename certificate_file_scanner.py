@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# certificate_file_scanner.py
+
+import asyncio
+import base64
+import hashlib
+import logging
+import mmap
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import pytz
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from async_database import (
+    get_certificate_file_index,
+    save_certificate_files,
+    remove_certificate_files,
+    get_expiring_file_certificates,
+)
+from bot_config import CERT_FILES_PATHS, CERT_FILES_EXTENSIONS, CERT_FILES_WORKERS, SSL_DIGEST_MODE
+from ssl_certificate_checker import TIMEZONE, WARNING_DAYS, get_expiry_alert, report_finding, send_digest
+
+# Настройки логирования
+logger = logging.getLogger(__name__)
+
+# Файлы больше этого размера читаются через mmap, а не целиком в память
+MMAP_THRESHOLD = 1024 * 1024
+# Сколько файлов разбирает процесс за одно задание: меньше накладных расходов на передачу
+SCAN_BATCH_SIZE = 64
+PEM_CERTIFICATE = re.compile(rb'-----BEGIN CERTIFICATE-----(.+?)-----END CERTIFICATE-----', re.DOTALL)
+
+# Пул процессов для разбора файлов, создается при первой проверке
+_process_pool = None
+_scan_lock = None
+
+
+def get_process_pool():
+    # Процессы запускаются через spawn: fork в процессе с потоками записи, чтения и DNS
+    # может скопировать захваченные блокировки. Импорт модулей бота в процессе пула
+    # не открывает базу данных — она инициализируется только в main()
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=CERT_FILES_WORKERS or None, mp_context=multiprocessing.get_context('spawn')
+        )
+    return _process_pool
+
+
+def find_certificate_files(paths, extensions):
+    # Путь -> (время изменения в наносекундах, размер) для всех файлов сертификатов в paths
+    files = {}
+    for root_path in paths:
+        if os.path.isfile(root_path):
+            candidates = [root_path]
+        else:
+            candidates = (
+                os.path.join(directory, name)
+                for directory, _, names in os.walk(root_path)
+                for name in names
+                if name.lower().endswith(extensions)
+            )
+        for path in candidates:
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                logger.warning(f"Не удалось прочитать сведения о файле {path}: {e}")
+                continue
+            files[os.path.abspath(path)] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def load_certificate_entry(der_cert):
+    cert = x509.load_der_x509_certificate(der_cert, default_backend())
+    common_names = cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)
+    issuers = cert.issuer.get_attributes_for_oid(x509.NameOID.COMMON_NAME)
+    return (
+        hashlib.sha256(der_cert).hexdigest(),
+        common_names[0].value if common_names else cert.subject.rfc4514_string(),
+        issuers[0].value if issuers else cert.issuer.rfc4514_string(),
+        int(cert.not_valid_after.replace(tzinfo=pytz.UTC).timestamp()),
+    )
+
+
+def parse_certificate_data(data):
+    # PEM-связка может содержать несколько сертификатов; без PEM-заголовков файл считается DER
+    blocks = [match.group(1) for match in PEM_CERTIFICATE.finditer(data)]
+    if not blocks:
+        if data[:1] != b'\x30':
+            raise ValueError("файл не содержит сертификатов в формате PEM или DER")
+        return [load_certificate_entry(bytes(data))]
+    return [load_certificate_entry(base64.b64decode(b''.join(block.split()))) for block in blocks]
+
+
+def parse_certificate_file(path):
+    # Выполняется в процессе пула. Возвращает (сертификаты, ошибка)
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return [], "пустой файл"
+            if size < MMAP_THRESHOLD:
+                return parse_certificate_data(f.read()), None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return parse_certificate_data(data), None
+    except Exception as e:
+        return [], str(e)
+
+
+def parse_certificate_files(paths):
+    # Задание для процесса пула: [(путь, сертификаты, ошибка)]
+    return [(path, *parse_certificate_file(path)) for path in paths]
+
+
+async def scan_certificate_files(context):
+    global _scan_lock
+    if not CERT_FILES_PATHS:
+        return
+    if _scan_lock is None:
+        _scan_lock = asyncio.Lock()
+    if _scan_lock.locked():
+        logger.info("Предыдущая проверка файлов сертификатов еще не завершена")
+        return
+    async with _scan_lock:
+        await update_certificate_files()
+        await check_file_certificates(context)
+
+
+async def update_certificate_files():
+    # Разбираются только новые и измененные файлы: время изменения и размер сравниваются с индексом
+    loop = asyncio.get_running_loop()
+    files = await loop.run_in_executor(None, find_certificate_files, CERT_FILES_PATHS, CERT_FILES_EXTENSIONS)
+    index = await get_certificate_file_index()
+
+    removed = [path for path in index if path not in files]
+    if removed:
+        await remove_certificate_files(removed)
+    changed = [path for path, stat in files.items() if index.get(path) != stat]
+    if not changed:
+        return
+    logger.info(f"Разбор файлов сертификатов: {len(changed)} из {len(files)}")
+
+    pool = get_process_pool()
+    batches = [changed[i:i + SCAN_BATCH_SIZE] for i in range(0, len(changed), SCAN_BATCH_SIZE)]
+    scanned_at = int(datetime.now(TIMEZONE).timestamp())
+    for batch_result in asyncio.as_completed(
+        [loop.run_in_executor(pool, parse_certificate_files, batch) for batch in batches]
+    ):
+        results = []
+        for path, certificates, error in await batch_result:
+            if error:
+                logger.warning(f"Ошибка при разборе файла сертификатов {path}: {error}")
+            results.append((path, *files[path], certificates, error))
+        await save_certificate_files(results, scanned_at)
+
+
+async def check_file_certificates(context):
+    # Те же пороги и учет отправленных предупреждений, что и для сайтов
+    now = datetime.now(TIMEZONE)
+    until = int((now + timedelta(days=WARNING_DAYS + 1)).timestamp())
+    findings = [] if SSL_DIGEST_MODE else None
+    for path, fingerprint, common_name, expiry_at in await get_expiring_file_certificates(until):
+        expiry_date = datetime.fromtimestamp(expiry_at, TIMEZONE)
+        days_to_expiry = (expiry_date.date() - now.date()).days
+        message = await get_expiry_alert(
+            path, f"в файле {path}", fingerprint, common_name, expiry_date, days_to_expiry
+        )
+        if message:
+            await report_finding(context, message, findings)
+    if findings:
+        await send_digest(context, findings)
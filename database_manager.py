@@ -1,13 +1,229 @@
 # -*- coding: utf-8 -*-
 # database_manager.py
 
+import logging
 import sqlite3
-from bot_config import DB_PATH
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import pytz
+from bot_config import DB_PATH, ACL_CACHE_TTL
+
+# Настройки логирования
+logger = logging.getLogger(__name__)
+
+# Размер кэша подготовленных выражений для каждого соединения
+STATEMENT_CACHE_SIZE = 256
+# Сколько ждать освобождения блокировки базы другим соединением, в секундах
+BUSY_TIMEOUT = 30
+
+# Даты хранятся номером дня от 1970-01-01, моменты времени — Unix-временем в секундах
+UNIX_EPOCH_DATE = date(1970, 1, 1)
+UNIX_EPOCH_JULIAN_DAY = 2440587.5
+# Часовой пояс, в котором бот записывал даты текстом до миграции 3
+LEGACY_TIMEZONE = pytz.timezone("Asia/Yekaterinburg")
+
+# Сколько строк читать за один fetchmany при построчном обходе таблиц
+STREAM_BATCH_SIZE = 500
+
+# Легкие объекты строк для построчного обхода таблиц
+NotificationRow = namedtuple(
+    'NotificationRow',
+    ['id', 'user_id', 'company', 'product', 'expiry_day', 'notify_date', 'quantity', 'notification_type'],
+)
+SiteRow = namedtuple(
+    'SiteRow',
+    [
+        'id',
+        'site',
+        'expiry_at',
+        'common_name',
+        'last_checked_at',
+        'probe_state',
+        'failure_count',
+        'retry_at',
+        'fingerprint',
+    ],
+)
+
+# Долгоживущее соединение для каждого потока (sqlite3 не разрешает использовать
+# одно соединение из разных потоков)
+_local = threading.local()
+
+# Кэш списков доступа в памяти процесса: множества разрешенных пользователей и чатов.
+# Множества неизменяемые и только заменяются целиком: их читают из цикла событий и потоков чтения.
+# ACL_CACHE_TTL > 0 нужен, если базу меняют несколько процессов бота
+_acl_lock = threading.Lock()
+_acl_users = None
+_acl_chats = None
+_acl_loaded_at = 0
+
+
+def get_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        # isolation_level=None: транзакции открываются только явно через transaction()
+        conn = sqlite3.connect(
+            DB_PATH,
+            timeout=BUSY_TIMEOUT,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-8000')  # Около 8 МБ страничного кэша
+        _local.conn = conn
+        _local.savepoint_depth = 0
+        _local.after_commit = []
+    return conn
+
+
+def close_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+@contextmanager
+def transaction():
+    # Явная транзакция записи; вложенные вызовы выполняются в точках сохранения
+    conn = get_connection()
+    if conn.in_transaction:
+        _local.savepoint_depth += 1
+        savepoint = f'sp_{_local.savepoint_depth}'
+        # Действия после фиксации, добавленные в отмененной точке сохранения, не выполняются
+        after_commit_count = len(_local.after_commit)
+        conn.execute(f'SAVEPOINT {savepoint}')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute(f'ROLLBACK TO {savepoint}')
+            conn.execute(f'RELEASE {savepoint}')
+            del _local.after_commit[after_commit_count:]
+            raise
+        else:
+            conn.execute(f'RELEASE {savepoint}')
+        finally:
+            _local.savepoint_depth -= 1
+    else:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            _local.after_commit.clear()
+            raise
+        else:
+            try:
+                conn.execute('COMMIT')
+            except BaseException:
+                _local.after_commit.clear()
+                raise
+        callbacks = _local.after_commit[:]
+        _local.after_commit.clear()
+        for callback in callbacks:
+            callback()
+
+
+def call_after_commit(callback):
+    # callback выполняется после фиксации внешней транзакции текущего потока
+    # (для пакета операций записи — после фиксации всего пакета)
+    get_connection()
+    _local.after_commit.append(callback)
+
+
+def _iter_rows(cursor, row_type, batch_size):
+    # Строки читаются пакетами, в памяти не больше одного пакета
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from map(row_type._make, rows)
+
+
+def to_day_number(value):
+    return (value - UNIX_EPOCH_DATE).days
+
+
+def from_day_number(day_number):
+    return UNIX_EPOCH_DATE + timedelta(days=day_number)
+
+
+def normalize_key(text):
+    # Ключ для поиска дубликатов: без лишних пробелов и без учета регистра
+    return ' '.join(str(text).split()).casefold()
+
+
+def _create_notification_indexes(cursor):
+    # Заполняем ключи для записей, созданных до появления этих столбцов
+    cursor.execute('SELECT id, company, product FROM notifications WHERE company_key IS NULL')
+    for notif_id, company, product in cursor.fetchall():
+        cursor.execute(
+            'UPDATE notifications SET company_key = ?, product_key = ? WHERE id = ?',
+            (normalize_key(company), normalize_key(product), notif_id),
+        )
+    try:
+        cursor.execute(
+            '''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_notifications_company_product
+            ON notifications (company_key, product_key)
+        '''
+        )
+    except sqlite3.IntegrityError:
+        # В старой базе уже есть дубликаты: оставляем обычный индекс, уникальность
+        # новых записей обеспечивает проверка при вставке
+        logger.warning(
+            "В таблице notifications есть повторяющиеся пары компания/продукт, "
+            "уникальный индекс не создан"
+        )
+        cursor.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_notifications_company_product_lookup
+            ON notifications (company_key, product_key)
+        '''
+        )
+
+
+def _get_schema_version(cursor):
+    cursor.execute('SELECT MAX(version) FROM schema_version')
+    return cursor.fetchone()[0] or 0
 
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    # Применяем недостающие миграции схемы, каждую в своей транзакции
+    with transaction() as conn:
+        conn.execute(
+            '''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+        )
+    for version, migration in enumerate(MIGRATIONS, 1):
+        with transaction() as conn:
+            cursor = conn.cursor()
+            # Версию проверяем внутри транзакции: миграцию мог применить другой процесс
+            if _get_schema_version(cursor) >= version:
+                continue
+            logger.info(f"Применение миграции схемы базы данных {version}: {migration.__name__}")
+            migration(cursor)
+            cursor.execute('INSERT INTO schema_version (version) VALUES (?)', (version,))
+    with transaction() as conn:
+        current_version = _get_schema_version(conn.cursor())
+    if current_version > len(MIGRATIONS):
+        logger.warning(
+            f"Версия схемы базы данных {current_version} новее известной боту ({len(MIGRATIONS)})"
+        )
+
+
+def _migrate_initial_schema(cursor):
+    # Миграция 1: схема до появления миграций. Таблицы создаются, только если их еще нет,
+    # поэтому миграция безопасно применяется и к уже существующим базам
 
     # Создаем таблицу для уведомлений
     cursor.execute(
@@ -70,227 +286,834 @@ def init_db():
     '''
     )
 
-    conn.commit()
-    conn.close()
+
+def _migrate_notification_keys(cursor):
+    # Миграция 2: нормализованные ключи компании и продукта для поиска дубликатов уведомлений
+    cursor.execute('ALTER TABLE notifications ADD COLUMN company_key TEXT')
+    cursor.execute('ALTER TABLE notifications ADD COLUMN product_key TEXT')
+    _create_notification_indexes(cursor)
+
+
+def _legacy_text_to_epoch(value):
+    if not value:
+        return None
+    return int(LEGACY_TIMEZONE.localize(datetime.strptime(value, '%Y-%m-%d %H:%M:%S')).timestamp())
+
+
+def _copy_autoincrement(cursor, table, new_table):
+    # Счетчик AUTOINCREMENT переносится в пересоздаваемую таблицу: id удаленных записей
+    # не выдаются повторно (иначе старая команда /delete_N удалила бы другую запись)
+    cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,))
+    row = cursor.fetchone()
+    if row is not None:
+        cursor.execute('DELETE FROM sqlite_sequence WHERE name = ?', (new_table,))
+        cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (new_table, row[0]))
+
+
+def _migrate_typed_dates(cursor):
+    # Миграция 3: даты хранятся целыми числами, SQL фильтрует и сортирует по ним без разбора строк.
+    # Таблицы пересоздаются с новыми столбцами, текстовые значения переносятся
+
+    # Уведомления: дата истечения (ГГГГ-ММ-ДД) — номер дня
+    cursor.execute(
+        '''
+    CREATE TABLE notifications_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        company TEXT,
+        product TEXT,
+        expiry_day INTEGER NOT NULL,
+        notify_date TEXT,
+        quantity TEXT,
+        notification_type TEXT,
+        company_key TEXT,
+        product_key TEXT
+    )
+    '''
+    )
+    cursor.execute(
+        f'''
+        INSERT INTO notifications_new (id, user_id, company, product, expiry_day, notify_date,
+                                       quantity, notification_type, company_key, product_key)
+        SELECT id, user_id, company, product,
+               CAST(julianday(expiry_date) - {UNIX_EPOCH_JULIAN_DAY} AS INTEGER),
+               notify_date, quantity, notification_type, company_key, product_key
+        FROM notifications
+    '''
+    )
+    _copy_autoincrement(cursor, 'notifications', 'notifications_new')
+    cursor.execute('DROP TABLE notifications')
+    cursor.execute('ALTER TABLE notifications_new RENAME TO notifications')
+    _create_notification_indexes(cursor)
+    cursor.execute('CREATE INDEX idx_notifications_expiry_day ON notifications (expiry_day)')
+
+    # Сайты: срок действия сертификата — Unix-время, добавляется время последней проверки.
+    # Текстовые значения записаны в местном времени бота
+    cursor.execute(
+        '''
+    CREATE TABLE monitored_sites_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        site TEXT UNIQUE COLLATE NOCASE,
+        expiry_at INTEGER,
+        common_name TEXT,
+        last_checked_at INTEGER
+    )
+    '''
+    )
+    cursor.execute('SELECT id, site, expiry_date, common_name FROM monitored_sites')
+    cursor.executemany(
+        '''
+        INSERT INTO monitored_sites_new (id, site, expiry_at, common_name) VALUES (?, ?, ?, ?)
+    ''',
+        [
+            (site_id, site, _legacy_text_to_epoch(expiry_date), common_name)
+            for site_id, site, expiry_date, common_name in cursor.fetchall()
+        ],
+    )
+    _copy_autoincrement(cursor, 'monitored_sites', 'monitored_sites_new')
+    cursor.execute('DROP TABLE monitored_sites')
+    cursor.execute('ALTER TABLE monitored_sites_new RENAME TO monitored_sites')
+    # Постраничный вывод сайтов по ближайшему истечению; сайты без данных о сертификате — первыми
+    cursor.execute('CREATE INDEX idx_monitored_sites_expiry ON monitored_sites (IFNULL(expiry_at, 0))')
+
+
+def _migrate_certificate_alerts(cursor):
+    # Миграция 4: отправленные предупреждения о сертификатах —
+    # не более одного предупреждения на порог для каждого сертификата сайта
+    cursor.execute(
+        '''
+    CREATE TABLE certificate_alerts (
+        site TEXT COLLATE NOCASE,
+        fingerprint TEXT,
+        threshold TEXT,
+        sent_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (site, fingerprint, threshold)
+    )
+    '''
+    )
+
+
+def _migrate_reminder_deliveries(cursor):
+    # Миграция 5: напоминания по лицензиям. Все напоминания уведомления записываются при его
+    # создании со статусом pending, каждое (уведомление, вид, номер дня) отправляется ровно один раз.
+    # due_at — Unix-время отправки
+    cursor.execute(
+        '''
+    CREATE TABLE reminder_deliveries (
+        notification_id INTEGER,
+        kind TEXT,
+        due_day INTEGER,
+        status TEXT,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        due_at INTEGER,
+        PRIMARY KEY (notification_id, kind, due_day)
+    )
+    '''
+    )
+    # Поиск наступивших напоминаний — диапазонный запрос по индексу ожидающих
+    cursor.execute(
+        "CREATE INDEX idx_reminder_deliveries_due ON reminder_deliveries (due_at) WHERE status = 'pending'"
+    )
+
+
+def _migrate_probe_health(cursor):
+    # Миграция 6: состояние доступности сайта (healthy, degraded, down), число ошибок подряд
+    # и Unix-время, раньше которого сайт повторно не проверяется
+    cursor.execute("ALTER TABLE monitored_sites ADD COLUMN probe_state TEXT NOT NULL DEFAULT 'healthy'")
+    cursor.execute('ALTER TABLE monitored_sites ADD COLUMN failure_count INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('ALTER TABLE monitored_sites ADD COLUMN retry_at INTEGER')
+    cursor.execute('ALTER TABLE monitored_sites ADD COLUMN last_error TEXT')
+
+
+def _migrate_certificate_history(cursor):
+    # Миграция 7: SHA-256 отпечаток текущего сертификата сайта и история замен сертификатов.
+    # В историю попадает по одной строке на каждый новый сертификат сайта
+    cursor.execute('ALTER TABLE monitored_sites ADD COLUMN fingerprint TEXT')
+    cursor.execute(
+        '''
+    CREATE TABLE certificate_history (
+        site TEXT COLLATE NOCASE,
+        fingerprint TEXT,
+        common_name TEXT,
+        issuer TEXT,
+        sans TEXT,
+        key_type TEXT,
+        not_before INTEGER,
+        not_after INTEGER,
+        first_seen_at INTEGER,
+        PRIMARY KEY (site, fingerprint)
+    ) WITHOUT ROWID
+    '''
+    )
+
+
+def _migrate_certificate_addresses(cursor):
+    # Миграция 8: результаты последней проверки каждого адреса сайта (при PROBE_ALL_ADDRESSES).
+    # fingerprint и expiry_at пусты, если адрес ответил ошибкой
+    cursor.execute(
+        '''
+    CREATE TABLE certificate_addresses (
+        site TEXT COLLATE NOCASE,
+        address TEXT,
+        fingerprint TEXT,
+        expiry_at INTEGER,
+        error TEXT,
+        checked_at INTEGER,
+        PRIMARY KEY (site, address)
+    ) WITHOUT ROWID
+    '''
+    )
+
+
+def _migrate_certificate_files(cursor):
+    # Миграция 9: проверка файлов сертификатов. certificate_files — индекс просмотренных файлов
+    # (время изменения и размер), file_certificates — сертификаты, найденные в каждом файле
+    cursor.execute(
+        '''
+    CREATE TABLE certificate_files (
+        path TEXT PRIMARY KEY,
+        mtime_ns INTEGER,
+        size INTEGER,
+        error TEXT,
+        scanned_at INTEGER
+    ) WITHOUT ROWID
+    '''
+    )
+    cursor.execute(
+        '''
+    CREATE TABLE file_certificates (
+        path TEXT,
+        fingerprint TEXT,
+        common_name TEXT,
+        issuer TEXT,
+        expiry_at INTEGER,
+        PRIMARY KEY (path, fingerprint)
+    ) WITHOUT ROWID
+    '''
+    )
+    # Предупреждения выбираются диапазоном по сроку истечения
+    cursor.execute('CREATE INDEX idx_file_certificates_expiry ON file_certificates (expiry_at)')
+
+
+# Миграции схемы по порядку, номер версии — позиция в списке начиная с 1.
+# Примененные миграции не изменяются: новые изменения схемы добавляются в конец списка
+MIGRATIONS = [
+    _migrate_initial_schema,
+    _migrate_notification_keys,
+    _migrate_typed_dates,
+    _migrate_certificate_alerts,
+    _migrate_reminder_deliveries,
+    _migrate_probe_health,
+    _migrate_certificate_history,
+    _migrate_certificate_addresses,
+    _migrate_certificate_files,
+]
 
 
 # Функции для работы с уведомлениями о лицензиях
 def save_notification_to_db(
-    user_id, company, product, expiry_date, notify_date, quantity, notification_type
+    user_id, company, product, expiry_day, notify_date, quantity, notification_type
 ):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    # Возвращает ID новой записи или None, если уведомление для этой компании и продукта
+    # уже существует. Проверка и вставка выполняются одним выражением по индексу
+    company_key = normalize_key(company)
+    product_key = normalize_key(product)
     try:
-        cursor.execute(
+        with transaction() as conn:
+            cursor = conn.execute(
+                '''
+                INSERT INTO notifications (user_id, company, product, expiry_day, notify_date, quantity,
+                                           notification_type, company_key, product_key)
+                SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM notifications WHERE company_key = ? AND product_key = ?
+                )
+            ''',
+                (
+                    user_id,
+                    company,
+                    product,
+                    expiry_day,
+                    notify_date,
+                    quantity,
+                    notification_type,
+                    company_key,
+                    product_key,
+                    company_key,
+                    product_key,
+                ),
+            )
+            return cursor.lastrowid if cursor.rowcount == 1 else None
+    except sqlite3.IntegrityError:
+        return None
+
+
+def import_notifications(user_id, notifications, notification_type):
+    # notifications: (company, product, expiry_day, quantity). Все записи вставляются одной
+    # транзакцией, пары компания/продукт, которые уже есть в базе, пропускаются.
+    # Возвращает добавленные записи: (id, company, expiry_day)
+    with transaction() as conn:
+        last_id = conn.execute('SELECT IFNULL(MAX(id), 0) FROM notifications').fetchone()[0]
+        conn.executemany(
             '''
-            INSERT INTO notifications (user_id, company, product, expiry_date, notify_date, quantity, notification_type)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            INSERT OR IGNORE INTO notifications (user_id, company, product, expiry_day, notify_date,
+                                                 quantity, notification_type, company_key, product_key)
+            SELECT ?, ?, ?, ?, '', ?, ?, ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM notifications WHERE company_key = ? AND product_key = ?
+            )
         ''',
-            (user_id, company, product, expiry_date, notify_date, quantity, notification_type),
+            (
+                (
+                    user_id,
+                    company,
+                    product,
+                    expiry_day,
+                    quantity,
+                    notification_type,
+                    normalize_key(company),
+                    normalize_key(product),
+                    normalize_key(company),
+                    normalize_key(product),
+                )
+                for company, product, expiry_day, quantity in notifications
+            ),
         )
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-    finally:
-        conn.close()
+        # Идентификаторы AUTOINCREMENT только растут, поэтому новые записи — с id больше прежнего максимума
+        cursor = conn.execute(
+            'SELECT id, company, expiry_day FROM notifications WHERE id > ? ORDER BY id', (last_id,)
+        )
+        return cursor.fetchall()
+
+
+def notification_exists(company, product):
+    cursor = get_connection().execute(
+        'SELECT 1 FROM notifications WHERE company_key = ? AND product_key = ?',
+        (normalize_key(company), normalize_key(product)),
+    )
+    return cursor.fetchone() is not None
 
 
 def delete_notification_from_db(notif_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM notifications WHERE id = ?', (notif_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('DELETE FROM notifications WHERE id = ?', (notif_id,))
+        conn.execute('DELETE FROM reminder_deliveries WHERE notification_id = ?', (notif_id,))
 
 
 def get_notifications_from_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        'SELECT id, user_id, company, product, expiry_date, notify_date, quantity, notification_type FROM notifications'
+    cursor = get_connection().execute(
+        'SELECT id, user_id, company, product, expiry_day, notify_date, quantity, notification_type FROM notifications'
+    )
+    return cursor.fetchall()
+
+
+def iter_notifications(after_id=0, batch_size=STREAM_BATCH_SIZE):
+    # Построчный обход уведомлений по возрастанию id, начиная после after_id.
+    # Генератор работает с соединением текущего потока
+    cursor = get_connection().execute(
+        '''
+        SELECT id, user_id, company, product, expiry_day, notify_date, quantity, notification_type
+        FROM notifications WHERE id > ? ORDER BY id
+    ''',
+        (after_id,),
+    )
+    return _iter_rows(cursor, NotificationRow, batch_size)
+
+
+def get_notifications_page(after=None, before=None, limit=10):
+    # Постраничный вывод по ближайшему истечению. Курсор — (expiry_day, id) последней записи
+    # предыдущей страницы (after) или первой записи следующей (before).
+    # Возвращает записи страницы по возрастанию и признак, что дальше в том же направлении есть еще записи
+    columns = 'id, user_id, company, product, expiry_day, notify_date, quantity, notification_type'
+    if before is not None:
+        cursor = get_connection().execute(
+            f'''
+            SELECT {columns} FROM notifications
+            WHERE (expiry_day, id) < (?, ?)
+            ORDER BY expiry_day DESC, id DESC LIMIT ?
+        ''',
+            (*before, limit + 1),
+        )
+        rows = cursor.fetchall()
+        return rows[:limit][::-1], len(rows) > limit
+    cursor = get_connection().execute(
+        f'''
+        SELECT {columns} FROM notifications
+        WHERE (expiry_day, id) > (?, ?)
+        ORDER BY expiry_day, id LIMIT ?
+    ''',
+        (*(after or (0, 0)), limit + 1),
+    )
+    rows = cursor.fetchall()
+    return rows[:limit], len(rows) > limit
+
+
+# Функции для работы с напоминаниями по лицензиям
+def schedule_reminders(reminders):
+    # reminders: (notification_id, kind, due_day, due_at, status); записанные ранее не меняются
+    with transaction() as conn:
+        conn.executemany(
+            '''
+            INSERT OR IGNORE INTO reminder_deliveries (notification_id, kind, due_day, due_at, status)
+            VALUES (?, ?, ?, ?, ?)
+        ''',
+            reminders,
+        )
+
+
+def reset_sending_reminders():
+    # Напоминания, отправка которых прервалась остановкой бота, снова ожидают отправки.
+    # Вызывается только при запуске, когда отправка еще не началась
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE reminder_deliveries SET status = 'pending', updated_at = CURRENT_TIMESTAMP WHERE status = 'sending'"
+        )
+
+
+def clear_pending_reminders():
+    # Перед пересчетом расписания при запуске (политики могли измениться):
+    # отправленные и пропущенные напоминания остаются в журнале
+    with transaction() as conn:
+        conn.execute("DELETE FROM reminder_deliveries WHERE status = 'pending'")
+
+
+def skip_superseded_reminders():
+    # Ожидающие напоминания, более ранние, чем уже отправленное или пропущенное
+    # напоминание того же уведомления, устарели
+    with transaction() as conn:
+        conn.execute(
+            '''
+            UPDATE reminder_deliveries SET status = 'skipped', updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'pending' AND due_day < (
+                SELECT MAX(done.due_day) FROM reminder_deliveries done
+                WHERE done.notification_id = reminder_deliveries.notification_id
+                  AND done.status != 'pending'
+            )
+        '''
+        )
+
+
+def get_due_reminders(now):
+    # Наступившие напоминания вместе с данными уведомлений в порядке отправки
+    cursor = get_connection().execute(
+        '''
+        SELECT r.notification_id, r.kind, r.due_day, n.user_id, n.company, n.product,
+               n.expiry_day, n.quantity
+        FROM reminder_deliveries r
+        JOIN notifications n ON n.id = r.notification_id
+        WHERE r.status = 'pending' AND r.due_at <= ?
+        ORDER BY r.due_at
+    ''',
+        (now,),
     )
-    notifications = cursor.fetchall()
-    conn.close()
-    return notifications
+    return cursor.fetchall()
+
+
+def get_next_reminder_due():
+    cursor = get_connection().execute(
+        "SELECT MIN(due_at) FROM reminder_deliveries WHERE status = 'pending'"
+    )
+    return cursor.fetchone()[0]
+
+
+def claim_reminder(notification_id, kind, due_day, status='sending'):
+    # Возвращает True, только если напоминание еще не было отправлено или пропущено
+    with transaction() as conn:
+        cursor = conn.execute(
+            '''
+            UPDATE reminder_deliveries SET status = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE notification_id = ? AND kind = ? AND due_day = ? AND status = 'pending'
+        ''',
+            (status, notification_id, kind, due_day),
+        )
+        return cursor.rowcount == 1
+
+
+def mark_reminder_sent(notification_id, kind, due_day):
+    with transaction() as conn:
+        conn.execute(
+            '''
+            UPDATE reminder_deliveries SET status = 'sent', updated_at = CURRENT_TIMESTAMP
+            WHERE notification_id = ? AND kind = ? AND due_day = ?
+        ''',
+            (notification_id, kind, due_day),
+        )
+
+
+def release_reminder(notification_id, kind, due_day, retry_at):
+    # Отправка не удалась: напоминание снова ожидает отправки в retry_at
+    with transaction() as conn:
+        conn.execute(
+            '''
+            UPDATE reminder_deliveries SET status = 'pending', due_at = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE notification_id = ? AND kind = ? AND due_day = ? AND status = 'sending'
+        ''',
+            (retry_at, notification_id, kind, due_day),
+        )
 
 
 # Функции для работы с мониторингом сайтов
 def add_monitored_site(site):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
     try:
-        cursor.execute('INSERT INTO monitored_sites (site) VALUES (?)', (site.lower(),))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute('INSERT INTO monitored_sites (site) VALUES (?)', (site.lower(),))
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 
 def add_monitored_sites(sites):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    added_sites = []
-    failed_sites = []
-    for site in sites:
-        try:
-            cursor.execute('INSERT INTO monitored_sites (site) VALUES (?)', (site.lower(),))
-            added_sites.append(site)
-        except sqlite3.IntegrityError:
-            failed_sites.append(site)
-    conn.commit()
-    conn.close()
-    return added_sites, failed_sites
+    # Вставка одним executemany. Возвращает (добавленные сайты, сайты, которые уже были в списке)
+    with transaction() as conn:
+        last_id = conn.execute('SELECT IFNULL(MAX(id), 0) FROM monitored_sites').fetchone()[0]
+        conn.executemany(
+            'INSERT OR IGNORE INTO monitored_sites (site) VALUES (?)', ((site.lower(),) for site in sites)
+        )
+        cursor = conn.execute('SELECT site FROM monitored_sites WHERE id > ? ORDER BY id', (last_id,))
+        added_sites = [row[0] for row in cursor]
+    added = set(added_sites)
+    return added_sites, [site for site in sites if site.lower() not in added]
 
 
 def get_monitored_sites():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT site FROM monitored_sites')
-    sites = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return sites
+    cursor = get_connection().execute('SELECT site FROM monitored_sites')
+    return [row[0] for row in cursor.fetchall()]
 
 
 def remove_monitored_site(site):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM monitored_sites WHERE site = ?', (site.lower(),))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('DELETE FROM monitored_sites WHERE site = ?', (site.lower(),))
+        conn.execute('DELETE FROM certificate_alerts WHERE site = ?', (site.lower(),))
+        conn.execute('DELETE FROM certificate_history WHERE site = ?', (site.lower(),))
+        conn.execute('DELETE FROM certificate_addresses WHERE site = ?', (site.lower(),))
 
 
-def update_certificate_info(site, expiry_date, common_name):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
+def update_certificate_info(site, expiry_at, common_name, last_checked_at=None, fingerprint=None):
+    # Успешная проверка сбрасывает счетчик ошибок сайта
+    with transaction() as conn:
+        conn.execute(
+            '''
+            UPDATE monitored_sites
+            SET expiry_at = ?, common_name = ?, last_checked_at = ?, fingerprint = ?,
+                probe_state = 'healthy', failure_count = 0, retry_at = NULL, last_error = NULL
+            WHERE site = ?
+        ''',
+            (expiry_at, common_name, last_checked_at, fingerprint, site.lower()),
+        )
+
+
+def replace_certificate_addresses(site, results, checked_at):
+    # results — [(адрес, отпечаток, Unix-время истечения, ошибка)]; адреса, пропавшие из DNS, удаляются
+    with transaction() as conn:
+        conn.execute('DELETE FROM certificate_addresses WHERE site = ?', (site.lower(),))
+        conn.executemany(
+            '''
+            INSERT INTO certificate_addresses (site, address, fingerprint, expiry_at, error, checked_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''',
+            [
+                (site.lower(), address, fingerprint, expiry_at, error, checked_at)
+                for address, fingerprint, expiry_at, error in results
+            ],
+        )
+
+
+def get_certificate_history_state(site, fingerprint):
+    # Возвращает (сертификат уже есть в истории сайта, наибольший срок действия среди известных сертификатов)
+    conn = get_connection()
+    known = conn.execute(
+        'SELECT 1 FROM certificate_history WHERE site = ? AND fingerprint = ?', (site.lower(), fingerprint)
+    ).fetchone()
+    latest_not_after = conn.execute(
+        'SELECT MAX(not_after) FROM certificate_history WHERE site = ?', (site.lower(),)
+    ).fetchone()[0]
+    return known is not None, latest_not_after
+
+
+def add_certificate_history(
+    site, fingerprint, common_name, issuer, sans, key_type, not_before, not_after, first_seen_at
+):
+    # Сертификат, уже записанный в историю сайта, повторно не добавляется
+    with transaction() as conn:
+        conn.execute(
+            '''
+            INSERT OR IGNORE INTO certificate_history
+                (site, fingerprint, common_name, issuer, sans, key_type, not_before, not_after, first_seen_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''',
+            (
+                site.lower(),
+                fingerprint,
+                common_name,
+                issuer,
+                sans,
+                key_type,
+                not_before,
+                not_after,
+                first_seen_at,
+            ),
+        )
+
+
+def record_probe_failure(site, probe_state, failure_count, retry_at, last_error):
+    with transaction() as conn:
+        conn.execute(
+            '''
+            UPDATE monitored_sites
+            SET probe_state = ?, failure_count = ?, retry_at = ?, last_error = ?
+            WHERE site = ?
+        ''',
+            (probe_state, failure_count, retry_at, last_error, site.lower()),
+        )
+
+
+def count_monitored_sites():
+    return get_connection().execute('SELECT COUNT(*) FROM monitored_sites').fetchone()[0]
+
+
+def iter_monitored_sites(after_id=0, batch_size=STREAM_BATCH_SIZE):
+    # Построчный обход сайтов вместе с данными сертификатов, см. iter_notifications
+    cursor = get_connection().execute(
         '''
-        UPDATE monitored_sites SET expiry_date = ?, common_name = ? WHERE site = ?
+        SELECT id, site, expiry_at, common_name, last_checked_at, probe_state, failure_count, retry_at,
+               fingerprint
+        FROM monitored_sites WHERE id > ? ORDER BY id
+    ''',
+        (after_id,),
+    )
+    return _iter_rows(cursor, SiteRow, batch_size)
+
+
+def get_sites_page(after=None, before=None, limit=10):
+    # Сайты вместе с данными сертификатов одним запросом, по ближайшему истечению.
+    # Курсор — (ключ сортировки, id), см. get_notifications_page
+    after = after or (0, 0)
+    columns = "id, site, expiry_at, common_name, IFNULL(expiry_at, 0), probe_state"
+    if before is not None:
+        cursor = get_connection().execute(
+            f'''
+            SELECT {columns} FROM monitored_sites
+            WHERE IFNULL(expiry_at, 0) <= ? AND (IFNULL(expiry_at, 0), id) < (?, ?)
+            ORDER BY IFNULL(expiry_at, 0) DESC, id DESC LIMIT ?
+        ''',
+            (before[0], *before, limit + 1),
+        )
+        rows = cursor.fetchall()
+        return rows[:limit][::-1], len(rows) > limit
+    cursor = get_connection().execute(
+        f'''
+        SELECT {columns} FROM monitored_sites
+        WHERE IFNULL(expiry_at, 0) >= ? AND (IFNULL(expiry_at, 0), id) > (?, ?)
+        ORDER BY IFNULL(expiry_at, 0), id LIMIT ?
     ''',
-        (expiry_date, common_name, site.lower()),
+        (after[0], *after, limit + 1),
     )
-    conn.commit()
-    conn.close()
+    rows = cursor.fetchall()
+    return rows[:limit], len(rows) > limit
 
 
 def get_certificate_info(site):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
+    cursor = get_connection().execute(
         '''
-        SELECT expiry_date, common_name FROM monitored_sites WHERE site = ?
+        SELECT expiry_at, common_name FROM monitored_sites WHERE site = ?
     ''',
         (site.lower(),),
     )
     result = cursor.fetchone()
-    conn.close()
     if result:
-        return {'expiry_date': result[0], 'common_name': result[1]}
+        return {'expiry_at': result[0], 'common_name': result[1]}
     else:
         return None
 
 
-# Функции для управления разрешенными пользователями
-def add_allowed_user(user_id, username, first_name, last_name):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
+def get_site_by_id(site_id):
+    cursor = get_connection().execute('SELECT site FROM monitored_sites WHERE id = ?', (site_id,))
+    result = cursor.fetchone()
+    return result[0] if result else None
+
+
+# Функции для проверки файлов сертификатов
+def get_certificate_file_index():
+    # Путь -> (время изменения в наносекундах, размер) для всех просмотренных файлов
+    cursor = get_connection().execute('SELECT path, mtime_ns, size FROM certificate_files')
+    return {path: (mtime_ns, size) for path, mtime_ns, size in cursor}
+
+
+def save_certificate_files(results, scanned_at):
+    # results — [(путь, время изменения, размер, [(отпечаток, CN, издатель, Unix-время истечения)], ошибка)].
+    # Сертификаты файла заменяются целиком; предупреждения для исчезнувших из файла сертификатов удаляются
+    with transaction() as conn:
+        for path, mtime_ns, size, certificates, error in results:
+            conn.execute(
+                '''
+                INSERT OR REPLACE INTO certificate_files (path, mtime_ns, size, error, scanned_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''',
+                (path, mtime_ns, size, error, scanned_at),
+            )
+            conn.execute('DELETE FROM file_certificates WHERE path = ?', (path,))
+            conn.executemany(
+                '''
+                INSERT OR IGNORE INTO file_certificates (path, fingerprint, common_name, issuer, expiry_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''',
+                [(path, *certificate) for certificate in certificates],
+            )
+            conn.execute(
+                '''
+                DELETE FROM certificate_alerts WHERE site = ? AND fingerprint NOT IN (
+                    SELECT fingerprint FROM file_certificates WHERE path = ?
+                )
+            ''',
+                (path, path),
+            )
+
+
+def remove_certificate_files(paths):
+    with transaction() as conn:
+        for path in paths:
+            conn.execute('DELETE FROM certificate_files WHERE path = ?', (path,))
+            conn.execute('DELETE FROM file_certificates WHERE path = ?', (path,))
+            conn.execute('DELETE FROM certificate_alerts WHERE site = ?', (path,))
+
+
+def get_expiring_file_certificates(until):
+    # Сертификаты из файлов, истекающие не позже Unix-времени until
+    cursor = get_connection().execute(
         '''
-        INSERT OR IGNORE INTO allowed_users (user_id, username, first_name, last_name)
-        VALUES (?, ?, ?, ?)
+        SELECT path, fingerprint, common_name, expiry_at FROM file_certificates
+        WHERE expiry_at <= ? ORDER BY expiry_at
     ''',
-        (user_id, username, first_name, last_name),
+        (until,),
     )
-    conn.commit()
-    conn.close()
+    return cursor.fetchall()
+
+
+# Функции для учета отправленных предупреждений о сертификатах
+def claim_certificate_alert(site, fingerprint, threshold):
+    # Возвращает True, только если предупреждение для этого порога еще не отправлялось.
+    # Вставка атомарна, поэтому между несколькими процессами бота предупреждение не дублируется
+    with transaction() as conn:
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO certificate_alerts (site, fingerprint, threshold) VALUES (?, ?, ?)',
+            (site.lower(), fingerprint, str(threshold)),
+        )
+        return cursor.rowcount == 1
+
+
+def clear_expired_certificate_alerts(site, expired_before):
+    # Удаляет предупреждения только для прежних сертификатов сайта, истекших раньше expired_before.
+    # Действующий прежний сертификат может вернуться (например, с другого сервера за балансировщиком),
+    # и его предупреждения не должны отправляться повторно
+    with transaction() as conn:
+        conn.execute(
+            '''
+            DELETE FROM certificate_alerts WHERE site = ? AND fingerprint IN (
+                SELECT fingerprint FROM certificate_history WHERE site = ? AND not_after < ?
+            )
+        ''',
+            (site.lower(), site.lower(), expired_before),
+        )
+
+
+# Функции для работы с кэшем списков доступа
+def load_acl_cache():
+    global _acl_users, _acl_chats, _acl_loaded_at
+    with _acl_lock:
+        conn = get_connection()
+        users = frozenset(row[0] for row in conn.execute('SELECT user_id FROM allowed_users'))
+        chats = frozenset(row[0] for row in conn.execute('SELECT chat_id FROM allowed_chats'))
+        _acl_users, _acl_chats = users, chats
+        _acl_loaded_at = time.monotonic()
+    return users, chats
+
+
+def invalidate_acl_cache():
+    # Вызывается после фиксации изменений списков доступа: кэш перечитывается при следующей проверке
+    global _acl_users, _acl_chats
+    with _acl_lock:
+        _acl_users = None
+        _acl_chats = None
+
+
+def is_acl_cache_fresh():
+    if _acl_users is None:
+        return False
+    return not ACL_CACHE_TTL or time.monotonic() - _acl_loaded_at < ACL_CACHE_TTL
+
+
+def _get_acl():
+    users, chats = _acl_users, _acl_chats
+    if users is None or chats is None or not is_acl_cache_fresh():
+        return load_acl_cache()
+    return users, chats
+
+
+# Функции для управления разрешенными пользователями
+def add_allowed_user(user_id, username, first_name, last_name):
+    with transaction() as conn:
+        conn.execute(
+            '''
+            INSERT OR IGNORE INTO allowed_users (user_id, username, first_name, last_name)
+            VALUES (?, ?, ?, ?)
+        ''',
+            (user_id, username, first_name, last_name),
+        )
+        call_after_commit(invalidate_acl_cache)
 
 
 def get_allowed_users():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id FROM allowed_users')
-    users = [row[0] for row in cursor.fetchall()]
-    conn.close()
+    users, _ = _get_acl()
     return set(users)
 
 
 def is_user_allowed(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT 1 FROM allowed_users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+    users, _ = _get_acl()
+    return user_id in users
 
 
 # Функции для управления запросами на доступ
 def add_access_request(user_id, username, first_name, last_name):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        INSERT OR IGNORE INTO access_requests (user_id, username, first_name, last_name)
-        VALUES (?, ?, ?, ?)
-    ''',
-        (user_id, username, first_name, last_name),
-    )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(
+            '''
+            INSERT OR IGNORE INTO access_requests (user_id, username, first_name, last_name)
+            VALUES (?, ?, ?, ?)
+        ''',
+            (user_id, username, first_name, last_name),
+        )
 
 
 def remove_access_request(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM access_requests WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('DELETE FROM access_requests WHERE user_id = ?', (user_id,))
 
 
 def is_access_request_pending(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT 1 FROM access_requests WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+    cursor = get_connection().execute('SELECT 1 FROM access_requests WHERE user_id = ?', (user_id,))
+    return cursor.fetchone() is not None
 
 
 def get_access_request_info(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
+    cursor = get_connection().execute(
         'SELECT username, first_name, last_name FROM access_requests WHERE user_id = ?',
         (user_id,),
     )
-    result = cursor.fetchone()
-    conn.close()
-    return result
+    return cursor.fetchone()
 
 
 # Функции для управления разрешенными чатами
 def add_allowed_chat(chat_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR IGNORE INTO allowed_chats (chat_id) VALUES (?)', (chat_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('INSERT OR IGNORE INTO allowed_chats (chat_id) VALUES (?)', (chat_id,))
+        call_after_commit(invalidate_acl_cache)
 
 
 def is_chat_allowed(chat_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT 1 FROM allowed_chats WHERE chat_id = ?', (chat_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+    _, chats = _get_acl()
+    return chat_id in chats
 
 
 def get_allowed_chats():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT chat_id FROM allowed_chats')
-    chats = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return chats
+    _, chats = _get_acl()
+    return list(chats)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# dns_cache.py
+
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+from bot_config import SSL_DNS_CACHE_TTL
+
+try:
+    import dns.asyncresolver
+    import dns.resolver
+except ImportError:
+    # Без dnspython адреса получаем через getaddrinfo, время жизни записей неизвестно
+    dns = None
+
+# Настройки логирования
+logger = logging.getLogger(__name__)
+
+# Записи с очень коротким временем жизни все равно хранятся не меньше этого числа секунд,
+# чтобы сайты за одним балансировщиком в течение проверки не запрашивали его адреса заново
+MIN_DNS_TTL = 30
+# Наибольшее число имен в кэше; при переполнении сначала удаляются устаревшие записи, затем самые старые
+MAX_DNS_CACHE_ENTRIES = 10000
+
+# Кэш адресов, общий для всех проверок: имя -> (момент устаревания по time.monotonic(), адреса).
+# Адрес — (семейство сокета, IP-адрес)
+_cache = {}
+# Незавершенные запросы: параллельные проверки одного имени ждут один ответ
+_pending = {}
+_resolver = None
+
+
+def get_resolver():
+    global _resolver
+    if _resolver is None:
+        _resolver = dns.asyncresolver.Resolver()
+    return _resolver
+
+
+async def query_addresses(hostname):
+    # Возвращает (адреса, время жизни в секундах, каноническое имя)
+    answers = await asyncio.gather(
+        *(get_resolver().resolve(hostname, record_type) for record_type in ('A', 'AAAA')),
+        return_exceptions=True,
+    )
+    addresses = []
+    ttl = SSL_DNS_CACHE_TTL
+    canonical_name = None
+    for family, answer in zip((socket.AF_INET, socket.AF_INET6), answers):
+        if isinstance(answer, dns.resolver.NoAnswer):
+            continue
+        if isinstance(answer, BaseException):
+            raise answer
+        addresses.extend((family, record.address) for record in answer)
+        ttl = min(ttl, answer.expiration - time.time())
+        canonical_name = answer.canonical_name.to_text(omit_final_dot=True).lower()
+    if not addresses:
+        raise OSError(f"Для {hostname} нет записей A и AAAA")
+    return addresses, ttl, canonical_name
+
+
+async def query_addresses_fallback(hostname, port):
+    loop = asyncio.get_running_loop()
+    infos = await loop.getaddrinfo(hostname, port, type=socket.SOCK_STREAM)
+    addresses = list(dict.fromkeys((family, address[0]) for family, _, _, _, address in infos))
+    return addresses, SSL_DNS_CACHE_TTL, None
+
+
+def store_addresses(hostname, expires_at, addresses):
+    if hostname not in _cache and len(_cache) >= MAX_DNS_CACHE_ENTRIES:
+        now = time.monotonic()
+        for name in [name for name, (name_expires_at, _) in _cache.items() if name_expires_at <= now]:
+            del _cache[name]
+        while len(_cache) >= MAX_DNS_CACHE_ENTRIES:
+            del _cache[next(iter(_cache))]
+    _cache[hostname] = (expires_at, addresses)
+
+
+def retrieve_lookup_error(task):
+    # Если все ожидавшие проверки отменены по тайм-ауту, ошибку запроса никто не прочитает
+    if not task.cancelled():
+        task.exception()
+
+
+async def lookup(hostname, port):
+    try:
+        if dns is not None:
+            try:
+                addresses, ttl, canonical_name = await query_addresses(hostname)
+            except Exception as e:
+                # Имена из /etc/hosts и локальных зон DNS-серверу неизвестны
+                logger.debug(f"DNS не вернул адреса {hostname} ({e}), используется getaddrinfo")
+                addresses, ttl, canonical_name = await query_addresses_fallback(hostname, port)
+        else:
+            addresses, ttl, canonical_name = await query_addresses_fallback(hostname, port)
+    finally:
+        _pending.pop(hostname, None)
+    expires_at = time.monotonic() + max(ttl, MIN_DNS_TTL)
+    store_addresses(hostname, expires_at, addresses)
+    # Цель CNAME тоже кэшируем: ее могут проверять как отдельный сайт
+    if canonical_name and canonical_name != hostname:
+        store_addresses(canonical_name, expires_at, addresses)
+    return addresses
+
+
+async def resolve_host(hostname, port=443):
+    # Все адреса имени с учетом времени жизни записей
+    hostname = hostname.lower()
+    try:
+        ip = ipaddress.ip_address(hostname)
+        return [(socket.AF_INET6 if ip.version == 6 else socket.AF_INET, hostname)]
+    except ValueError:
+        pass
+    cached = _cache.get(hostname)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    task = _pending.get(hostname)
+    if task is None:
+        task = _pending[hostname] = asyncio.ensure_future(lookup(hostname, port))
+        task.add_done_callback(retrieve_lookup_error)
+    # Тайм-аут одной проверки не должен отменять запрос, которого ждут другие
+    return await asyncio.shield(task)
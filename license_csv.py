@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# license_csv.py
+
+import csv
+import io
+from datetime import datetime
+from database_manager import iter_notifications, normalize_key, to_day_number, from_day_number
+
+# Столбцы файла импорта и выгрузки
+CSV_HEADER = ['Компания', 'Продукт', 'Дата истечения', 'Количество']
+# Разделитель выгрузки: с точкой с запятой файл открывается в Excel с русскими настройками
+CSV_DELIMITER = ';'
+DATE_FORMATS = ('%d.%m.%Y', '%Y-%m-%d')
+# Сколько строк с ошибками перечислять в ответе пользователю
+MAX_REPORTED_ERRORS = 10
+
+
+def parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    return None
+
+
+def detect_dialect(sample):
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        return csv.excel
+
+
+def parse_licenses_csv(data, today):
+    # Разбирает файл построчно. Возвращает (записи для вставки, число повторов в файле, ошибки),
+    # записи — (компания, продукт, номер дня истечения, количество)
+    text = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline='')
+    dialect = detect_dialect(text.read(4096))
+    text.seek(0)
+
+    notifications = []
+    seen = set()
+    duplicates = 0
+    errors = []
+    for line_number, row in enumerate(csv.reader(text, dialect), 1):
+        cells = [cell.strip() for cell in row]
+        if not any(cells):
+            continue
+        company, product, expiry_date_str, quantity = (cells + [''] * 4)[:4]
+        expiry_date = parse_date(expiry_date_str)
+        if expiry_date is None:
+            # Первая строка без даты — заголовок
+            if line_number > 1:
+                errors.append(f"Строка {line_number}: неверная дата '{expiry_date_str}'")
+            continue
+        if not company or not product:
+            errors.append(f"Строка {line_number}: не указана компания или продукт")
+            continue
+        if expiry_date < today:
+            errors.append(f"Строка {line_number}: дата истечения {expiry_date_str} уже прошла")
+            continue
+        key = (normalize_key(company), normalize_key(product))
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        notifications.append((company, product, to_day_number(expiry_date), quantity))
+    return notifications, duplicates, errors
+
+
+def export_licenses_csv():
+    # Выполняется в потоке чтения базы: уведомления читаются пакетами и сразу записываются в файл
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=CSV_DELIMITER)
+    writer.writerow(CSV_HEADER)
+    for notif in iter_notifications():
+        writer.writerow(
+            [
+                notif.company,
+                notif.product,
+                from_day_number(notif.expiry_day).strftime('%d.%m.%Y'),
+                notif.quantity or '',
+            ]
+        )
+    # BOM нужен, чтобы Excel распознал кодировку UTF-8
+    return output.getvalue().encode('utf-8-sig')
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# license_reminders.py
+
+from collections import namedtuple
+from datetime import datetime, timedelta, time
+import pytz
+from bot_config import REMINDER_POLICIES
+from business_calendar import previous_working_day
+from database_manager import normalize_key, to_day_number
+
+# Настройки напоминаний
+TIMEZONE = pytz.timezone("Asia/Yekaterinburg")
+
+# Политика напоминаний: за сколько дней до истечения напоминать (по убыванию,
+# 0 — в день истечения) и в какое время отправлять
+ReminderPolicy = namedtuple('ReminderPolicy', ['offsets', 'send_time'])
+
+DEFAULT_POLICY = ReminderPolicy(offsets=(7, 0), send_time=time(9, 0))
+
+
+def parse_policy(name, options, base):
+    # Незаданные параметры берутся из базовой политики
+    offsets = base.offsets
+    if 'offsets' in options:
+        offsets = {int(value) for value in options['offsets'].split(',') if value.strip()}
+        if any(offset < 0 for offset in offsets):
+            raise ValueError(f"Отрицательное смещение напоминания в секции [{name}]")
+        offsets = tuple(sorted(offsets, reverse=True))
+    send_time = base.send_time
+    if 'send_time' in options:
+        send_time = datetime.strptime(options['send_time'].strip(), '%H:%M').time()
+    return ReminderPolicy(offsets, send_time)
+
+
+def load_policies(sections):
+    default_policy = parse_policy('Reminders', sections.get('Reminders', {}), DEFAULT_POLICY)
+    type_policies = {}
+    company_policies = {}
+    for name, options in sections.items():
+        _, _, key = name.partition(':')
+        if not key:
+            continue
+        if key.startswith('company:'):
+            company_policies[normalize_key(key[len('company:'):])] = parse_policy(
+                name, options, default_policy
+            )
+        else:
+            type_policies[normalize_key(key)] = parse_policy(name, options, default_policy)
+    return default_policy, type_policies, company_policies
+
+
+_default_policy, _type_policies, _company_policies = load_policies(REMINDER_POLICIES)
+
+
+def get_reminder_policy(company, notification_type):
+    # Политика компании важнее политики типа уведомления
+    policy = _company_policies.get(normalize_key(company))
+    if policy is None:
+        policy = _type_policies.get(normalize_key(notification_type), _default_policy)
+    return policy
+
+
+def adjust_for_weekend(date):
+    # Если дата приходится на выходной или праздник, переносим на предыдущий рабочий день
+    return previous_working_day(date)
+
+
+def get_license_reminders(expiry_date, policy=DEFAULT_POLICY):
+    # Напоминания по лицензии в порядке отправки: (вид, дата отправки)
+    reminders = []
+    for offset in policy.offsets:
+        if offset == 0:
+            kind, date = 'expiry_day', expiry_date
+        else:
+            kind, date = f'before_{offset}', adjust_for_weekend(expiry_date - timedelta(days=offset))
+        # После переноса с выходных и праздников напоминания могут совпасть: оставляем более позднее
+        while reminders and reminders[-1][1] >= date:
+            reminders.pop()
+        reminders.append((kind, date))
+    reminders.append(('expired', expiry_date + timedelta(days=1)))
+    return reminders
+
+
+def get_reminder_instant(date, policy=DEFAULT_POLICY):
+    return TIMEZONE.localize(datetime.combine(date, policy.send_time))
+
+
+def build_reminder_rows(notif_id, company, notification_type, expiry_date, skip_before=None):
+    # Строки таблицы напоминаний: (ID уведомления, вид, номер дня, Unix-время отправки, статус).
+    # Напоминания со временем отправки не позже skip_before сразу отмечаются пропущенными
+    policy = get_reminder_policy(company, notification_type)
+    rows = []
+    for kind, date in get_license_reminders(expiry_date, policy):
+        instant = get_reminder_instant(date, policy)
+        status = 'skipped' if skip_before is not None and instant <= skip_before else 'pending'
+        rows.append((notif_id, kind, to_day_number(date), int(instant.timestamp()), status))
+    return rows
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# message_queue.py
+
+import asyncio
+import logging
+import time
+from collections import deque
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.ext import BaseRateLimiter
+
+# Настройки логирования
+logger = logging.getLogger(__name__)
+
+# Приоритеты отправки: чем меньше значение, тем раньше сообщение уходит из очереди
+PRIORITY_INTERACTIVE = 0  # Ответы пользователям (по умолчанию для всех запросов)
+PRIORITY_NORMAL = 1  # Напоминания о лицензиях
+PRIORITY_BULK = 2  # Массовые уведомления о сертификатах
+
+# Сколько последних корзин чатов хранить, прежде чем удалять заполненные (неактивные)
+MAX_IDLE_CHAT_BUCKETS = 1000
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        # Через сколько секунд будет доступен один токен
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+# Общая очередь исходящих запросов к Bot API: все запросы с chat_id проходят через общий лимит
+# и лимит своего чата, ожидающие запросы разложены по очередям приоритетов (приоритет передается
+# через rate_limit_args). При RetryAfter и сетевых ошибках запрос повторяется автоматически
+class OutboundRateLimiter(BaseRateLimiter):
+    def __init__(
+        self,
+        global_rate=30,
+        private_chat_rate=1,
+        group_chat_rate=20 / 60,
+        max_retries=3,
+    ):
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._private_chat_rate = private_chat_rate
+        self._group_chat_rate = group_chat_rate
+        self._max_retries = max_retries
+        self._chat_buckets = {}
+        self._lanes = {
+            PRIORITY_INTERACTIVE: deque(),
+            PRIORITY_NORMAL: deque(),
+            PRIORITY_BULK: deque(),
+        }
+        self._paused_until = 0
+        self._wakeup = None
+        self._dispatcher = None
+        self._sent = 0
+        self._retries = 0
+        self._failed = 0
+        self._latency_total = 0
+        self._latency_max = 0
+
+    async def initialize(self):
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for lane in self._lanes.values():
+            for _, future in lane:
+                future.cancel()
+            lane.clear()
+
+    def get_stats(self):
+        average_latency = self._latency_total / self._sent if self._sent else 0
+        return {
+            'queued': {priority: len(lane) for priority, lane in self._lanes.items()},
+            'sent': self._sent,
+            'retries': self._retries,
+            'failed': self._failed,
+            'average_latency': average_latency,
+            'max_latency': self._latency_max,
+        }
+
+    def _get_chat_bucket(self, chat_id, now):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_IDLE_CHAT_BUCKETS:
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.is_full(now)
+                }
+            # У групп и каналов отрицательный ID или @username, для них лимит строже
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(self._private_chat_rate, 1)
+            else:
+                bucket = TokenBucket(self._group_chat_rate, 1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _pop_ready(self, now):
+        # Первый по приоритету запрос, чат которого не упирается в свой лимит
+        min_wait = None
+        for priority in sorted(self._lanes):
+            lane = self._lanes[priority]
+            for index, (chat_id, future) in enumerate(lane):
+                if future.done():
+                    continue
+                wait = self._get_chat_bucket(chat_id, now).wait_time(now)
+                if wait == 0:
+                    del lane[index]
+                    return chat_id, future, 0
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+            # Отмененные запросы удаляем из очереди
+            self._lanes[priority] = deque(item for item in lane if not item[1].done())
+        return None, None, min_wait
+
+    async def _wait_for_wakeup(self, timeout):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dispatch(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while any(self._lanes.values()):
+                now = time.monotonic()
+                delay = max(self._paused_until - now, self._global_bucket.wait_time(now))
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                chat_id, future, chat_delay = self._pop_ready(now)
+                if future is None:
+                    if chat_delay is None:
+                        break
+                    # Все ожидающие упираются в лимиты своих чатов: ждем или нового запроса
+                    self._wakeup.clear()
+                    await self._wait_for_wakeup(chat_delay)
+                    continue
+                self._global_bucket.consume(now)
+                self._get_chat_bucket(chat_id, now).consume(now)
+                future.set_result(None)
+
+    async def _acquire(self, chat_id, priority):
+        future = asyncio.get_running_loop().create_future()
+        self._lanes.get(priority, self._lanes[PRIORITY_NORMAL]).append((chat_id, future))
+        self._wakeup.set()
+        try:
+            await future
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        # Запросы без чата (getUpdates, answerCallbackQuery и т.п.) не ограничиваем
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+
+        priority = PRIORITY_INTERACTIVE if rate_limit_args is None else rate_limit_args
+        queued_at = time.monotonic()
+        attempt = 0
+        while True:
+            await self._acquire(chat_id, priority)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self._max_retries:
+                    self._failed += 1
+                    raise
+                # Telegram просит подождать: приостанавливаем всю очередь
+                logger.warning(f"Превышен лимит Telegram ({endpoint}), повтор через {e.retry_after} с")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            except BadRequest:
+                self._failed += 1
+                raise
+            except NetworkError as e:
+                if attempt >= self._max_retries:
+                    self._failed += 1
+                    raise
+                logger.warning(f"Сетевая ошибка при запросе {endpoint}: {e}, повтор через {2 ** attempt} с")
+                await asyncio.sleep(2 ** attempt)
+            except Exception:
+                self._failed += 1
+                raise
+            else:
+                latency = time.monotonic() - queued_at
+                self._sent += 1
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+                return result
+            attempt += 1
+            self._retries += 1
@@ -1,16 +1,45 @@
 # -*- coding: utf-8 -*-
 # ssl_certificate_checker.py
 
+import hashlib
+import heapq
 import logging
 import ssl
 import socket
-from datetime import datetime
+import struct
+import zlib
+from collections import namedtuple, OrderedDict
+from datetime import datetime, timedelta
 import pytz
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
-from database_manager import get_monitored_sites, update_certificate_info, get_allowed_chats
+from cryptography.hazmat.primitives.asymmetric import ec, ed448, ed25519, rsa
+from async_database import (
+    iter_monitored_sites,
+    count_monitored_sites,
+    update_certificate_info,
+    record_probe_failure,
+    add_certificate_history,
+    replace_certificate_addresses,
+    get_allowed_chats,
+    claim_certificate_alert,
+    clear_expired_certificate_alerts,
+    get_certificate_history_state,
+)
 import asyncio
-from bot_config import ADMIN_ID
+from message_queue import PRIORITY_BULK
+from bot_config import (
+    ADMIN_ID,
+    SSL_PROBE_CONCURRENCY,
+    SSL_CONNECT_TIMEOUT,
+    SSL_HANDSHAKE_TIMEOUT,
+    SSL_DIGEST_MODE,
+    SSL_NOTIFY_CONCURRENCY,
+    SSL_PROBE_ALL_ADDRESSES,
+    SSL_SWEEP_MODE,
+    SSL_ROLLING_INTERVAL,
+)
+from dns_cache import resolve_host
 from urllib.parse import urlparse
 
 # Настройки логирования
@@ -18,87 +47,827 @@ logger = logging.getLogger(__name__)
 
 # Настройки проверки сертификатов
 TIMEZONE = pytz.timezone("Asia/Yekaterinburg")
-cert_notification_status = {}
+# За сколько дней до истечения начинаются ежедневные предупреждения
+WARNING_DAYS = 7
+# Максимальная длина сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
 
+# Интервал между проверками сайта в зависимости от числа дней до истечения сертификата
+CHECK_INTERVALS = [
+    (0, timedelta(hours=1)),  # Сертификат истек или истекает сегодня
+    (7, timedelta(hours=3)),
+    (30, timedelta(hours=12)),
+    (90, timedelta(days=1)),
+]
+FAR_EXPIRY_CHECK_INTERVAL = timedelta(days=7)
+# Повторная проверка вскоре после замены сертификата и после ошибки
+ROTATION_RECHECK_INTERVAL = timedelta(hours=1)
+FAILURE_RETRY_INTERVAL = timedelta(hours=1)
 
-async def check_certificates(context):
-    sites = get_monitored_sites()
-    tasks = []
+# Режимы плановых проверок: adaptive — интервал зависит от срока истечения (CHECK_INTERVALS),
+# rolling — каждый сайт проверяется раз в SSL_ROLLING_INTERVAL минут в своем слоте
+SWEEP_ADAPTIVE = 'adaptive'
+SWEEP_ROLLING = 'rolling'
+if SSL_SWEEP_MODE not in (SWEEP_ADAPTIVE, SWEEP_ROLLING):
+    raise ValueError(f"Неизвестный режим проверки сертификатов SWEEP_MODE = {SSL_SWEEP_MODE}")
+if SSL_ROLLING_INTERVAL <= 0:
+    raise ValueError("ROLLING_INTERVAL должен быть больше нуля")
+
+# Доступность сайта: после первой ошибки сайт нестабилен (degraded), после DOWN_AFTER_FAILURES
+# ошибок подряд — недоступен (down). Уведомления отправляются только при переходе в down
+# и при восстановлении. Повторная попытка после ошибки откладывается экспоненциально:
+# FAILURE_RETRY_INTERVAL, вдвое больше и так далее, но не дольше MAX_FAILURE_BACKOFF
+PROBE_HEALTHY = 'healthy'
+PROBE_DEGRADED = 'degraded'
+PROBE_DOWN = 'down'
+DOWN_AFTER_FAILURES = 3
+MAX_FAILURE_BACKOFF = timedelta(days=1)
+
+# Сведения о сертификате, разобранные из DER: для проверки срока и для истории замен
+CertificateInfo = namedtuple(
+    'CertificateInfo',
+    ['fingerprint', 'common_name', 'issuer', 'sans', 'key_type', 'not_before', 'expiry_date'],
+)
+# Сколько разобранных сертификатов хранить в кэше по отпечатку
+CERT_PARSE_CACHE_SIZE = 10000
+
+# Адрес проверки: сайт (ключ в списке), хост, порт и протокол. Протокол 'tls' — TLS сразу
+# после подключения, остальные — переход на TLS командой STARTTLS своего протокола
+SiteAddress = namedtuple('SiteAddress', ['site', 'host', 'port', 'protocol'])
+PROTOCOL_TLS = 'tls'
+# Схема адреса -> (протокол, порт по умолчанию). Для tls:// порт обязателен
+SCHEME_DEFAULTS = {
+    'https': (PROTOCOL_TLS, 443),
+    'http': (PROTOCOL_TLS, 443),
+    'tls': (PROTOCOL_TLS, None),
+    'smtps': (PROTOCOL_TLS, 465),
+    'imaps': (PROTOCOL_TLS, 993),
+    'pop3s': (PROTOCOL_TLS, 995),
+    'ldaps': (PROTOCOL_TLS, 636),
+    'smtp': ('smtp', 25),
+    'imap': ('imap', 143),
+    'pop3': ('pop3', 110),
+    'postgres': ('postgres', 5432),
+    'postgresql': ('postgres', 5432),
+}
+DEFAULT_TLS_PORT = 443
+# Имя, которым бот представляется SMTP-серверу
+SMTP_EHLO_NAME = 'bothelper'
+# Запрос SSLRequest протокола PostgreSQL: длина сообщения и код запроса
+POSTGRES_SSL_REQUEST = struct.pack('!ii', 8, 80877103)
+
+# Очередь с приоритетом (время следующей проверки, сайт). Запись в очереди актуальна,
+# только если время совпадает с _next_check_at[site]; None означает, что проверка идет сейчас
+_check_queue = []
+_next_check_at = {}
+# Последний известный сертификат сайта: сайт -> (отпечаток, Unix-время истечения)
+_last_certificate = {}
+_schedule_loaded = False
+# Сайты с ошибками проверки: сайт -> (состояние, ошибок подряд, время следующей попытки)
+_probe_health = {}
+
+# Полная проверка по запросу пользователей выполняется в фоне одна: повторные запросы
+# присоединяются к ней. Слушатели вызываются как listener(проверено, ошибок, всего, завершено)
+_full_sweep_task = None
+_full_sweep_listeners = []
+
+
+def get_check_interval(days_to_expiry):
+    for max_days, interval in CHECK_INTERVALS:
+        if days_to_expiry <= max_days:
+            return interval
+    return FAR_EXPIRY_CHECK_INTERVAL
+
+
+def get_failure_backoff(failure_count):
+    # Показатель степени ограничен, чтобы не переполнить timedelta
+    return min(FAILURE_RETRY_INTERVAL * 2 ** min(failure_count - 1, 16), MAX_FAILURE_BACKOFF)
+
+
+def is_in_backoff(site, now):
+    health = _probe_health.get(site.lower())
+    return health is not None and health[2] > now
+
+
+def count_sites_in_backoff():
+    now = datetime.now(TIMEZONE)
+    return sum(1 for _, _, retry_at in _probe_health.values() if retry_at > now)
+
+
+def get_rolling_slot(site):
+    # Минута интервала, в которую проверяется сайт. crc32 равномерно распределяет сайты
+    # и, в отличие от hash(), не меняется между перезапусками бота
+    return zlib.crc32(site.lower().encode()) % SSL_ROLLING_INTERVAL
+
+
+def get_previous_slot_time(site, now):
+    # Последнее наступление слота сайта не позже now; интервалы отсчитываются от начала Unix-времени
+    interval = SSL_ROLLING_INTERVAL * 60
+    timestamp = int(now.timestamp())
+    slot_time = timestamp - (timestamp - get_rolling_slot(site) * 60) % interval
+    return datetime.fromtimestamp(slot_time, TIMEZONE)
+
+
+def get_next_check_interval(site, days_to_expiry, renewed):
+    if SSL_SWEEP_MODE == SWEEP_ROLLING:
+        now = datetime.now(TIMEZONE)
+        return get_previous_slot_time(site, now) + timedelta(minutes=SSL_ROLLING_INTERVAL) - now
+    # Сертификат заменен: проверяем повторно вскоре, иначе реже по мере удаленности срока
+    if renewed:
+        return ROTATION_RECHECK_INTERVAL
+    return get_check_interval(days_to_expiry)
+
+
+def schedule_site_check(site, when):
+    site = site.lower()
+    _next_check_at[site] = when
+    heapq.heappush(_check_queue, (when, site))
+
+
+def unschedule_site_check(site):
+    site = site.lower()
+    _next_check_at.pop(site, None)
+    _last_certificate.pop(site, None)
+    _probe_health.pop(site, None)
+
+
+async def load_check_schedule():
+    global _schedule_loaded
+    # Флаг ставится сразу, чтобы параллельная проверка не загрузила расписание повторно
+    _schedule_loaded = True
+    now = datetime.now(TIMEZONE)
+    missed_slots = 0
+    async for row in iter_monitored_sites():
+        when = now
+        if row.failure_count:
+            # Сайт с ошибками проверяется не раньше отложенной попытки
+            retry_at = datetime.fromtimestamp(row.retry_at or 0, TIMEZONE)
+            _probe_health[row.site.lower()] = (row.probe_state, row.failure_count, retry_at)
+            when = max(now, retry_at)
+        elif SSL_SWEEP_MODE == SWEEP_ROLLING:
+            # Сразу после запуска проверяются только сайты, чей слот прошел без проверки,
+            # остальные — в следующем слоте
+            previous_slot = get_previous_slot_time(row.site, now)
+            if row.last_checked_at and row.last_checked_at >= previous_slot.timestamp():
+                when = previous_slot + timedelta(minutes=SSL_ROLLING_INTERVAL)
+            else:
+                missed_slots += 1
+        elif row.expiry_at and row.last_checked_at:
+            expiry_date = datetime.fromtimestamp(row.expiry_at, TIMEZONE)
+            last_checked = datetime.fromtimestamp(row.last_checked_at, TIMEZONE)
+            days_to_expiry = (expiry_date.date() - now.date()).days
+            when = max(now, last_checked + get_check_interval(days_to_expiry))
+        _last_certificate[row.site.lower()] = (row.fingerprint, row.expiry_at)
+        schedule_site_check(row.site, when)
+    logger.info(f"Загружено расписание проверки сертификатов для {len(_next_check_at)} сайтов")
+    if SSL_SWEEP_MODE == SWEEP_ROLLING:
+        logger.info(f"Сайтов с пропущенным слотом проверки: {missed_slots}")
+
+
+def pop_due_sites(now):
+    due_sites = []
+    while _check_queue and _check_queue[0][0] <= now:
+        when, site = heapq.heappop(_check_queue)
+        if _next_check_at.get(site) == when:
+            _next_check_at[site] = None
+            due_sites.append(site)
+    return due_sites
+
+
+def claim_site_check(site):
+    # Отмечает сайт как проверяемый, как pop_due_sites. Возвращает False, если сайт уже
+    # проверяется: повторная проверка удвоила бы учет ошибок при недоступности сайта
+    site = site.lower()
+    if site in _next_check_at and _next_check_at[site] is None:
+        return False
+    _next_check_at[site] = None
+    return True
+
+
+def reschedule_site_check(site, interval):
+    # Сайт, удаленный во время проверки, обратно в очередь не попадает
+    if site.lower() in _next_check_at:
+        schedule_site_check(site, datetime.now(TIMEZONE) + interval)
+
+
+async def check_due_certificates(context):
+    if not _schedule_loaded:
+        await load_check_schedule()
+    due_sites = pop_due_sites(datetime.now(TIMEZONE))
+    if not due_sites:
+        return
+    logger.info(f"Плановая проверка сертификатов: {len(due_sites)} сайтов")
+    await run_sweep(due_sites, context)
+
+
+async def check_certificates(context, progress=None):
+    if not _schedule_loaded:
+        await load_check_schedule()
+    # Сайты, повторная попытка для которых после ошибок еще не наступила, пропускаются,
+    # как и сайты, которые уже проверяет планировщик. Сайт отмечается, когда его берет обработчик
+    now = datetime.now(TIMEZONE)
+    sites = (
+        row.site
+        async for row in iter_monitored_sites()
+        if not is_in_backoff(row.site, now) and claim_site_check(row.site)
+    )
+    return await run_sweep(sites, context, progress)
+
+
+def start_full_sweep(context, listener=None):
+    # Возвращает True, если запущена новая проверка, и False, если запрос присоединился к идущей
+    global _full_sweep_task
+    if listener:
+        _full_sweep_listeners.append(listener)
+    if _full_sweep_task is not None and not _full_sweep_task.done():
+        return False
+    _full_sweep_task = context.application.create_task(run_full_sweep(context))
+    return True
+
+
+async def notify_full_sweep_listeners(listeners, checked, failed, total, finished):
+    results = await asyncio.gather(
+        *(listener(checked, failed, total, finished) for listener in listeners),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"Ошибка при уведомлении о ходе проверки сертификатов: {result}")
+
+
+async def run_full_sweep(context):
+    global _full_sweep_task
+    if not _schedule_loaded:
+        await load_check_schedule()
+    total = await count_monitored_sites() - count_sites_in_backoff()
+
+    async def progress(checked, failed):
+        await notify_full_sweep_listeners(list(_full_sweep_listeners), checked, failed, total, False)
+
+    checked, failed = 0, 0
+    try:
+        checked, failed = await check_certificates(context, progress)
+    finally:
+        # Следующий запрос запустит новую проверку
+        listeners = list(_full_sweep_listeners)
+        _full_sweep_listeners.clear()
+        _full_sweep_task = None
+        await notify_full_sweep_listeners(listeners, checked, failed, total, True)
+
+
+async def iterate_sites(sites):
     for site in sites:
-        tasks.append(process_site_certificate(site, context))
+        yield site
 
-    await asyncio.gather(*tasks)
 
+async def probe_new_sites(sites, context, progress=None):
+    # Немедленная проверка только что добавленных сайтов, не дожидаясь планировщика.
+    # Пока идет проверка, планировщик эти сайты не выбирает
+    for site in sites:
+        _next_check_at[site.lower()] = None
+    return await run_sweep(sites, context, progress)
+
+
+async def run_sweep(sites, context, progress=None):
+    # sites — список или асинхронный итератор. Сайты берутся по мере освобождения
+    # обработчиков, поэтому одновременно существует не больше SSL_PROBE_CONCURRENCY задач.
+    # progress(проверено, ошибок) вызывается после каждого сайта. Возвращает (проверено, ошибок)
+    if not hasattr(sites, '__anext__'):
+        sites = iterate_sites(sites)
+    # В режиме сводки результаты всех проверок собираются и отправляются одним сообщением
+    findings = [] if SSL_DIGEST_MODE else None
+    # Асинхронный генератор нельзя продвигать из нескольких задач одновременно
+    next_site_lock = asyncio.Lock()
+    checked = 0
+    failed = 0
+
+    async def worker():
+        nonlocal checked, failed
+        while True:
+            async with next_site_lock:
+                try:
+                    site = await sites.__anext__()
+                except StopAsyncIteration:
+                    return
+            if not await process_site_certificate(site, context, findings):
+                failed += 1
+            checked += 1
+            if progress:
+                await progress(checked, failed)
 
-async def process_site_certificate(site, context):
     try:
-        expiry_date, common_name = await get_ssl_expiry_date(site)
-        expiry_date_str = expiry_date.strftime('%Y-%m-%d %H:%M:%S')
-        update_certificate_info(site, expiry_date_str, common_name)
+        await asyncio.gather(*(worker() for _ in range(SSL_PROBE_CONCURRENCY)))
+    finally:
+        # Собранные результаты отправляются, даже если проверка прервалась ошибкой
+        if findings:
+            await send_digest(context, findings)
+    return checked, failed
+
+
+async def process_site_certificate(site, context, findings=None):
+    try:
+        address_results = None
+        if SSL_PROBE_ALL_ADDRESSES:
+            certificate, address_results = await get_address_certificates(site)
+        else:
+            certificate = await get_site_certificate(site)
+        expiry_date, common_name, fingerprint = (
+            certificate.expiry_date,
+            certificate.common_name,
+            certificate.fingerprint,
+        )
+        expiry_at = int(expiry_date.timestamp())
+        checked_at = int(datetime.now(TIMEZONE).timestamp())
+        await update_certificate_info(site, expiry_at, common_name, checked_at, fingerprint)
+        if address_results is not None:
+            await replace_certificate_addresses(site, address_results, checked_at)
+            await report_address_mismatch(site, certificate, address_results, context, findings)
+
+        previous_health = _probe_health.pop(site.lower(), None)
+        if previous_health and previous_health[0] == PROBE_DOWN:
+            logger.info(f"Сайт {site} снова доступен")
+            await report_finding(
+                context,
+                f"✅ Сайт {site} снова доступен после {previous_health[1]} неудачных проверок подряд.",
+                findings,
+            )
 
         days_to_expiry = (expiry_date.date() - datetime.now(TIMEZONE).date()).days
 
-        message = ""
-        if days_to_expiry < 0:
+        # Замена определяется по отпечатку; для сайтов, проверенных до появления отпечатков, — по сроку
+        previous_fingerprint, previous_expiry = _last_certificate.get(site.lower(), (None, None))
+        _last_certificate[site.lower()] = (fingerprint, expiry_at)
+        renewed = False
+        if previous_fingerprint != fingerprint:
+            known, latest_not_after = await get_certificate_history_state(site, fingerprint)
+            if previous_fingerprint:
+                # Смена отпечатка — замена, только если сертификат новый для сайта или действует дольше
+                # всех известных. Иначе это прежний сертификат, который отдал другой сервер за балансировщиком
+                renewed = not known or expiry_at > (latest_not_after or 0)
+            else:
+                renewed = bool(previous_expiry) and previous_expiry != expiry_at
+            if not known:
+                await add_certificate_history(
+                    site,
+                    fingerprint,
+                    common_name,
+                    certificate.issuer,
+                    ','.join(certificate.sans),
+                    certificate.key_type,
+                    int(certificate.not_before.timestamp()),
+                    expiry_at,
+                    checked_at,
+                )
+
+        reschedule_site_check(site, get_next_check_interval(site, days_to_expiry, renewed))
+        if renewed:
+            logger.info(
+                f"Сертификат для {site} заменен, срок действия до {expiry_date.strftime('%d.%m.%Y %H:%M:%S')}"
+            )
+            await clear_expired_certificate_alerts(site, checked_at)
+            # Сообщение о замене отправляется один раз на сертификат
+            if await claim_certificate_alert(site, fingerprint, 'renewed'):
+                await report_finding(
+                    context,
+                    f"🔄 Сертификат для сайта {site} обновлен (CN: {common_name}, издатель: {certificate.issuer}), "
+                    f"действует до {expiry_date.strftime('%d.%m.%Y')}.",
+                    findings,
+                )
+
+        if days_to_expiry > WARNING_DAYS:
+            logger.info(
+                f"Сертификат для {site} в порядке ({'обновлен' if renewed else 'без изменений'}), "
+                f"истекает через {days_to_expiry} дней."
+            )
+        message = await get_expiry_alert(
+            site, f"для сайта {site}", fingerprint, common_name, expiry_date, days_to_expiry
+        )
+        if message:
+            await report_finding(context, message, findings)
+        return True
+
+    except Exception as e:
+        logger.error(f"Ошибка при проверке SSL-сертификата для {site}: {e}")
+        try:
+            await handle_probe_failure(site, context, e, findings)
+        except Exception as failure_error:
+            logger.error(f"Ошибка при обработке неудачной проверки {site}: {failure_error}")
+        finally:
+            # Сайт, снятый с очереди pop_due_sites, возвращается в нее при любой ошибке
+            if _next_check_at.get(site.lower(), False) is None:
+                reschedule_site_check(site, FAILURE_RETRY_INTERVAL)
+        return False
+
+
+async def get_expiry_alert(alert_key, subject, fingerprint, common_name, expiry_date, days_to_expiry):
+    # Каждое предупреждение отправляется один раз на порог для конкретного сертификата.
+    # alert_key — сайт или путь к файлу сертификата, subject — как назвать сертификат в тексте.
+    # Возвращает текст предупреждения или пустую строку
+    if days_to_expiry < 0:
+        if await claim_certificate_alert(alert_key, fingerprint, 'expired'):
             days_since_expired = abs(days_to_expiry)
-            message = (
-                f"⚠️ Внимание! Сертификат для сайта {site} (CN: {common_name}) истёк "
+            return (
+                f"⚠️ Внимание! Сертификат {subject} (CN: {common_name}) истёк "
                 f"{expiry_date.strftime('%d.%m.%Y')} ({days_since_expired} дней назад)."
             )
-        elif days_to_expiry == 0:
-            message = (
-                f"⚠️ Внимание! Сертификат для сайта {site} (CN: {common_name}) истекает сегодня "
+    elif days_to_expiry == 0:
+        if await claim_certificate_alert(alert_key, fingerprint, 'today'):
+            return (
+                f"⚠️ Внимание! Сертификат {subject} (CN: {common_name}) истекает сегодня "
                 f"{expiry_date.strftime('%d.%m.%Y')}."
             )
-        elif days_to_expiry <= 7 and days_to_expiry not in cert_notification_status.get(site, []):
-            message = (
-                f"⚠️ Внимание! Сертификат для сайта {site} (CN: {common_name}) истекает "
+    elif days_to_expiry <= WARNING_DAYS:
+        if await claim_certificate_alert(alert_key, fingerprint, days_to_expiry):
+            return (
+                f"⚠️ Внимание! Сертификат {subject} (CN: {common_name}) истекает "
                 f"{expiry_date.strftime('%d.%m.%Y')} (через {days_to_expiry} дней)."
             )
-            cert_notification_status.setdefault(site, []).append(days_to_expiry)
-        else:
-            # Сброс уведомлений, если до истечения больше 10 дней
-            cert_notification_status[site] = []
-            logger.info(
-                f"Сертификат для {site} в порядке, истекает через {days_to_expiry} дней."
+    return ""
+
+
+async def handle_probe_failure(site, context, error, findings=None):
+    # Сайт, удаленный во время проверки, не отслеживается
+    if site.lower() not in _next_check_at:
+        return
+    previous_state, failure_count, _ = _probe_health.get(site.lower(), (PROBE_HEALTHY, 0, None))
+    failure_count += 1
+    state = PROBE_DOWN if failure_count >= DOWN_AFTER_FAILURES else PROBE_DEGRADED
+    backoff = get_failure_backoff(failure_count)
+    retry_at = datetime.now(TIMEZONE) + backoff
+    _probe_health[site.lower()] = (state, failure_count, retry_at)
+    await record_probe_failure(site, state, failure_count, int(retry_at.timestamp()), str(error))
+    reschedule_site_check(site, backoff)
+
+    if state == PROBE_DOWN and previous_state != PROBE_DOWN:
+        message = (
+            f"❗️ Сайт {site} недоступен: {failure_count} проверок подряд завершились ошибкой. "
+            f"Последняя ошибка: {error}. Следующая попытка {retry_at.strftime('%d.%m.%Y %H:%M')}."
+        )
+        await report_finding(context, message, findings)
+    else:
+        logger.warning(
+            f"Сайт {site}: ошибок подряд {failure_count}, повторная проверка {retry_at.strftime('%d.%m.%Y %H:%M')}"
+        )
+
+
+async def report_address_mismatch(site, certificate, address_results, context, findings=None):
+    # Разные сертификаты на адресах сайта: предупреждение один раз на набор сертификатов
+    fingerprints = sorted({fingerprint for _, fingerprint, _, _ in address_results if fingerprint})
+    if len(fingerprints) < 2:
+        return
+    threshold = 'addresses ' + ','.join(fingerprint[:16] for fingerprint in fingerprints)
+    if not await claim_certificate_alert(site, certificate.fingerprint, threshold):
+        return
+    lines = [f"⚠️ Адреса сайта {site} отдают разные сертификаты:"]
+    for address, fingerprint, expiry_at, _ in address_results:
+        if fingerprint:
+            expiry_date = datetime.fromtimestamp(expiry_at, TIMEZONE)
+            lines.append(f"{address}: до {expiry_date.strftime('%d.%m.%Y')} (отпечаток {fingerprint[:16]})")
+    await report_finding(context, '\n'.join(lines), findings)
+
+
+async def report_finding(context, message, findings=None):
+    if findings is not None:
+        findings.append(message)
+    else:
+        await send_notification(context, message)
+
+
+def create_ssl_context():
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE  # Игнорируем ошибки сертификата
+    return context
+
+
+# Общий SSL-контекст для всех проверок: создание контекста на каждое подключение слишком дорогое
+SSL_CONTEXT = create_ssl_context()
+# Ограничение числа одновременных проверок, создается при первом использовании внутри цикла событий
+_probe_semaphore = None
+# Разобранные сертификаты по SHA-256 отпечатку DER, в порядке последнего использования
+_parse_cache = OrderedDict()
+
+
+def get_probe_semaphore():
+    global _probe_semaphore
+    if _probe_semaphore is None:
+        _probe_semaphore = asyncio.Semaphore(SSL_PROBE_CONCURRENCY)
+    return _probe_semaphore
+
+
+async def open_tcp_connection(hostname, port, addresses=None):
+    # Неблокирующее подключение: перебираем адреса так же, как socket.create_connection.
+    # Без addresses адреса берутся из getaddrinfo, как при обычном подключении (с учетом /etc/hosts)
+    loop = asyncio.get_running_loop()
+    if addresses is None:
+        infos = await loop.getaddrinfo(hostname, port, type=socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys((family, address[0]) for family, _, _, _, address in infos))
+    last_error = None
+    for family, address in addresses:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, (address, port))
+            return sock
+        except OSError as e:
+            sock.close()
+            last_error = e
+        except BaseException:
+            # Отмена по тайм-ауту: не оставляем открытый сокет
+            sock.close()
+            raise
+    raise last_error or OSError(f"Не удалось получить адрес для {hostname}")
+
+
+async def read_reply_line(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Сервер закрыл соединение")
+    return line.rstrip(b'\r\n')
+
+
+async def expect_smtp_reply(reader, code):
+    # Многострочный ответ SMTP: '250-...' продолжается, '250 ...' завершает ответ
+    while True:
+        line = await read_reply_line(reader)
+        if not line.startswith(code):
+            raise ConnectionError(f"Неожиданный ответ SMTP: {line.decode(errors='replace')}")
+        if line[3:4] != b'-':
+            return
+
+
+async def expect_reply(reader, prefix):
+    line = await read_reply_line(reader)
+    if not line.startswith(prefix):
+        raise ConnectionError(f"Неожиданный ответ сервера: {line.decode(errors='replace')}")
+
+
+async def negotiate_smtp(reader, writer):
+    await expect_smtp_reply(reader, b'220')
+    writer.write(f"EHLO {SMTP_EHLO_NAME}\r\n".encode())
+    await expect_smtp_reply(reader, b'250')
+    writer.write(b'STARTTLS\r\n')
+    await expect_smtp_reply(reader, b'220')
+
+
+async def negotiate_imap(reader, writer):
+    await expect_reply(reader, b'* OK')
+    writer.write(b'A1 STARTTLS\r\n')
+    # До ответа с тегом сервер может прислать непомеченные строки
+    while True:
+        line = await read_reply_line(reader)
+        if line.startswith(b'A1 '):
+            if not line.startswith(b'A1 OK'):
+                raise ConnectionError(f"Сервер отказал в STARTTLS: {line.decode(errors='replace')}")
+            return
+
+
+async def negotiate_pop3(reader, writer):
+    await expect_reply(reader, b'+OK')
+    writer.write(b'STLS\r\n')
+    await expect_reply(reader, b'+OK')
+
+
+async def negotiate_postgres(reader, writer):
+    writer.write(POSTGRES_SSL_REQUEST)
+    if await reader.readexactly(1) != b'S':
+        raise ConnectionError("Сервер PostgreSQL не поддерживает SSL")
+
+
+# Переход на TLS внутри открытого соединения для протоколов со STARTTLS
+STARTTLS_NEGOTIATORS = {
+    'smtp': negotiate_smtp,
+    'imap': negotiate_imap,
+    'pop3': negotiate_pop3,
+    'postgres': negotiate_postgres,
+}
+
+
+async def start_tls(sock, hostname, protocol):
+    # Возвращает транспорт с установленным TLS
+    if protocol == PROTOCOL_TLS:
+        _, writer = await asyncio.open_connection(sock=sock, ssl=SSL_CONTEXT, server_hostname=hostname)
+        return writer.transport
+    reader, writer = await asyncio.open_connection(sock=sock)
+    try:
+        await STARTTLS_NEGOTIATORS[protocol](reader, writer)
+        return await asyncio.get_running_loop().start_tls(
+            writer.transport, writer.transport.get_protocol(), SSL_CONTEXT, server_hostname=hostname
+        )
+    except BaseException:
+        writer.close()
+        raise
+
+
+async def fetch_certificate(hostname, port=DEFAULT_TLS_PORT, addresses=None, protocol=PROTOCOL_TLS):
+    # Возвращает сертификат сервера в формате DER, не блокируя цикл событий.
+    # Все протоколы проверяются в пределах одного ограничения числа одновременных проверок
+    async with get_probe_semaphore():
+        try:
+            sock = await asyncio.wait_for(
+                open_tcp_connection(hostname, port, addresses), timeout=SSL_CONNECT_TIMEOUT
             )
+        except asyncio.TimeoutError:
+            raise TimeoutError("Тайм-аут при попытке подключения")
+
+        try:
+            # Тайм-аут установки TLS включает обмен командами STARTTLS
+            transport = await asyncio.wait_for(
+                start_tls(sock, hostname, protocol), timeout=SSL_HANDSHAKE_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            sock.close()
+            raise TimeoutError("Тайм-аут при установке TLS-соединения")
+        except BaseException:
+            sock.close()
+            raise
+
+        try:
+            return transport.get_extra_info('ssl_object').getpeercert(binary_form=True)
+        finally:
+            transport.close()
+
+
+def describe_public_key(public_key):
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return f"RSA {public_key.key_size}"
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return f"EC {public_key.curve.name}"
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return "Ed25519"
+    if isinstance(public_key, ed448.Ed448PublicKey):
+        return "Ed448"
+    return type(public_key).__name__
+
+
+def get_name_attribute(name, oid):
+    attributes = name.get_attributes_for_oid(oid)
+    return attributes[0].value if attributes else None
+
+
+def parse_certificate(der_cert):
+    # Сайты отдают один и тот же сертификат неделями: разбираем DER только для нового отпечатка
+    fingerprint = hashlib.sha256(der_cert).hexdigest()
+    certificate = _parse_cache.get(fingerprint)
+    if certificate is not None:
+        _parse_cache.move_to_end(fingerprint)
+        return certificate
+
+    cert = x509.load_der_x509_certificate(der_cert, default_backend())
+    try:
+        sans = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+        sans = tuple(sans.get_values_for_type(x509.DNSName))
+    except x509.ExtensionNotFound:
+        sans = ()
+    common_name = get_name_attribute(cert.subject, x509.NameOID.COMMON_NAME)
+    if common_name is None:
+        raise ValueError("в сертификате не указано имя (CN)")
+    certificate = CertificateInfo(
+        fingerprint=fingerprint,
+        common_name=common_name,
+        issuer=get_name_attribute(cert.issuer, x509.NameOID.COMMON_NAME) or cert.issuer.rfc4514_string(),
+        sans=sans,
+        key_type=describe_public_key(cert.public_key()),
+        not_before=cert.not_valid_before.replace(tzinfo=pytz.UTC).astimezone(TIMEZONE),
+        expiry_date=cert.not_valid_after.replace(tzinfo=pytz.UTC).astimezone(TIMEZONE),
+    )
+    _parse_cache[fingerprint] = certificate
+    if len(_parse_cache) > CERT_PARSE_CACHE_SIZE:
+        _parse_cache.popitem(last=False)
+    return certificate
+
+
+def parse_site_address(text):
+    # Разбирает строку вида 'example.com', 'example.com:8443', 'imaps://mail.example.com'
+    # или 'smtp://mail.example.com:587'. Возвращает SiteAddress или None, если строка не распознана.
+    # Ключ сайта — каноническая запись: только хост для HTTPS на порту 443, 'хост:порт' для
+    # других портов с TLS и 'протокол://хост:порт' для STARTTLS
+    text = text.strip()
+    if '://' not in text:
+        text = 'https://' + text
+    try:
+        parsed_url = urlparse(text)
+        scheme = parsed_url.scheme.lower()
+        host = parsed_url.hostname
+        port = parsed_url.port
+    except ValueError:
+        return None
+    if scheme not in SCHEME_DEFAULTS or not host or any(char.isspace() for char in host):
+        return None
+    protocol, default_port = SCHEME_DEFAULTS[scheme]
+    port = port or default_port
+    if port is None:
+        return None
+    host_part = f"[{host}]" if ':' in host else host
+    if protocol != PROTOCOL_TLS:
+        site = f"{protocol}://{host_part}:{port}"
+    elif port != DEFAULT_TLS_PORT:
+        site = f"{host_part}:{port}"
+    else:
+        site = host_part
+    return SiteAddress(site, host, port, protocol)
+
+
+def get_site_address(site):
+    address = parse_site_address(site)
+    if address is None:
+        raise ValueError(f"Не удалось разобрать адрес сайта {site}")
+    return address
 
-        if message:
-            await send_notification(context, message)
 
+async def get_address_certificates(site):
+    # Проверка каждого адреса сайта одновременно. Возвращает (сертификат с ближайшим истечением,
+    # [(адрес, отпечаток, Unix-время истечения, ошибка)]). Ошибка — только если не ответил ни один адрес
+    target = get_site_address(site)
+    try:
+        addresses = await resolve_host(target.host, target.port)
     except Exception as e:
-        logger.error(f"Ошибка при проверке SSL-сертификата для {site}: {e}")
-        message = f"❗️ Ошибка при проверке сертификата для {site}: {e}"
-        await send_notification(context, message)
+        raise Exception(f"Ошибка при получении адресов: {e}")
+    responses = await asyncio.gather(
+        *(
+            fetch_certificate(target.host, target.port, [address], target.protocol)
+            for address in addresses
+        ),
+        return_exceptions=True,
+    )
+    certificates = []
+    results = []
+    for (_, address), response in zip(addresses, responses):
+        try:
+            if isinstance(response, Exception):
+                raise response
+            certificate = parse_certificate(response)
+        except Exception as e:
+            logger.warning(f"Ошибка при проверке адреса {address} сайта {site}: {e}")
+            results.append((address, None, None, str(e)))
+            continue
+        certificates.append(certificate)
+        results.append((address, certificate.fingerprint, int(certificate.expiry_date.timestamp()), None))
+    if not certificates:
+        raise Exception(f"Ошибка при получении сертификата: {results[0][3]}")
+    return min(certificates, key=lambda certificate: certificate.expiry_date), results
 
 
-async def get_ssl_expiry_date(site):
+async def get_site_certificate(site):
     try:
-        parsed_url = urlparse(site)
-        hostname = parsed_url.hostname or parsed_url.path
-        context = ssl.create_default_context()
-        context.check_hostname = False
-        context.verify_mode = ssl.CERT_NONE  # Игнорируем ошибки сертификата
-        # Устанавливаем тайм-аут для подключения
-        sock = socket.create_connection((hostname, 443), timeout=5)
-        with context.wrap_socket(sock, server_hostname=hostname) as ssock:
-            der_cert = ssock.getpeercert(binary_form=True)
-            cert = x509.load_der_x509_certificate(der_cert, default_backend())
-            expiry_date = cert.not_valid_after.replace(tzinfo=pytz.UTC).astimezone(TIMEZONE)
-            common_name = cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)[0].value
-            return expiry_date, common_name
-    except socket.timeout:
-        raise Exception("Тайм-аут при попытке подключения")
+        target = get_site_address(site)
+        der_cert = await fetch_certificate(target.host, target.port, protocol=target.protocol)
+        return parse_certificate(der_cert)
+    except TimeoutError as e:
+        raise Exception(str(e))
     except Exception as e:
         raise Exception(f"Ошибка при получении сертификата: {e}")
 
 
+def split_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    # Делит текст на части не длиннее limit, по возможности по границам строк
+    chunks = []
+    current = ''
+    for line in text.split('\n'):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if current and len(current) + 1 + len(line) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def get_notification_chats():
+    # Разрешенные чаты и администратор, без повторов
+    return list(dict.fromkeys(await get_allowed_chats() + [ADMIN_ID]))
+
+
+async def fan_out_messages(context, chat_ids, chunks):
+    # Рассылка с ограничением числа одновременных отправок; части в каждом чате идут по порядку
+    semaphore = asyncio.Semaphore(SSL_NOTIFY_CONCURRENCY)
+
+    async def deliver(chat_id):
+        async with semaphore:
+            for chunk in chunks:
+                try:
+                    await context.bot.send_message(
+                        chat_id=chat_id, text=chunk, rate_limit_args=PRIORITY_BULK
+                    )
+                except Exception as e:
+                    logger.error(f"Ошибка при отправке уведомления в чат {chat_id}: {e}")
+                    return
+
+    await asyncio.gather(*[deliver(chat_id) for chat_id in chat_ids])
+
+
+async def send_digest(context, findings):
+    text = f"🔔 Итоги проверки SSL-сертификатов ({len(findings)}):\n\n" + "\n\n".join(sorted(findings))
+    # Список чатов загружается один раз на всю сводку
+    await fan_out_messages(context, await get_notification_chats(), split_message(text))
+
+
 async def send_notification(context, message):
-    allowed_chats = get_allowed_chats()
-    for chat_id in allowed_chats:
-        try:
-            await context.bot.send_message(chat_id=chat_id, text=message)
-        except Exception as e:
-            logger.error(f"Ошибка при отправке уведомления в чат {chat_id}: {e}")
-    # Отправляем уведомление админу
-    await context.bot.send_message(chat_id=ADMIN_ID, text=message)
+    await fan_out_messages(context, await get_notification_chats(), split_message(message))
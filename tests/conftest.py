@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# tests/conftest.py
+
+import os
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# bot_config читает config.ini из текущего каталога при импорте: тесты работают
+# во временном каталоге с минимальной конфигурацией и отдельной базой данных
+_test_dir = tempfile.mkdtemp(prefix='license-bot-tests-')
+with open(os.path.join(_test_dir, 'config.ini'), 'w', encoding='utf-8') as f:
+    f.write(
+        '[Telegram]\n'
+        'TOKEN = 123:test\n'
+        'ADMIN_ID = 1\n'
+        '[Database]\n'
+        f'DB_PATH = {os.path.join(_test_dir, "database.db")}\n'
+    )
+os.chdir(_test_dir)
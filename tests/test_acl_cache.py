@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# tests/test_acl_cache.py
+
+import asyncio
+import pytest
+import async_database
+import database_manager
+from database_manager import add_allowed_chat, add_allowed_user, is_chat_allowed, is_user_allowed, transaction
+
+
+@pytest.fixture(autouse=True)
+def acl_tables():
+    database_manager.init_db()
+    with transaction() as conn:
+        conn.execute('DELETE FROM allowed_users')
+        conn.execute('DELETE FROM allowed_chats')
+    database_manager.load_acl_cache()
+
+
+def test_sync_grant_is_visible():
+    assert not is_user_allowed(8)
+    add_allowed_user(8, 'user', 'First', 'Last')
+    assert is_user_allowed(8)
+    assert not is_chat_allowed(-100)
+    add_allowed_chat(-100)
+    assert is_chat_allowed(-100)
+
+
+def test_grant_is_visible_only_after_outer_commit():
+    assert not is_user_allowed(9)
+    with transaction():
+        add_allowed_user(9, 'user', 'First', 'Last')
+        assert database_manager._acl_users is not None
+    assert is_user_allowed(9)
+
+
+def test_rolled_back_grant_is_not_cached():
+    assert not is_user_allowed(10)
+    with pytest.raises(RuntimeError):
+        with transaction():
+            add_allowed_user(10, 'user', 'First', 'Last')
+            raise RuntimeError
+    assert database_manager._acl_users is not None
+    assert not is_user_allowed(10)
+
+
+def test_async_grant_is_visible():
+    async def grant():
+        try:
+            assert not await async_database.is_chat_allowed(-200)
+            await async_database.add_allowed_chat(-200)
+            return await async_database.is_chat_allowed(-200)
+        finally:
+            await async_database.close()
+
+    assert asyncio.run(grant())
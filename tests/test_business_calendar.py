@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# tests/test_business_calendar.py
+
+import os
+from datetime import date, timedelta
+import pytest
+import business_calendar
+from business_calendar import is_working_day, load_calendar, previous_working_day
+
+CALENDAR_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'production_calendar.txt')
+
+
+@pytest.fixture(autouse=True)
+def production_calendar():
+    load_calendar(CALENDAR_PATH)
+    yield
+    load_calendar(CALENDAR_PATH)
+
+
+def days(first, last):
+    return [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+
+
+@pytest.mark.parametrize('first, last', [
+    (date(2024, 1, 1), date(2024, 1, 8)),
+    (date(2024, 4, 28), date(2024, 5, 1)),
+    (date(2024, 5, 9), date(2024, 5, 12)),
+    (date(2024, 12, 29), date(2025, 1, 8)),
+    (date(2025, 5, 1), date(2025, 5, 4)),
+    (date(2025, 5, 8), date(2025, 5, 11)),
+    (date(2025, 6, 12), date(2025, 6, 15)),
+    (date(2025, 11, 2), date(2025, 11, 4)),
+    (date(2025, 12, 31), date(2026, 1, 11)),
+    (date(2026, 5, 9), date(2026, 5, 11)),
+])
+def test_holiday_blocks_are_not_working(first, last):
+    assert not any(is_working_day(day) for day in days(first, last))
+
+
+@pytest.mark.parametrize('first, last, expected', [
+    (date(2024, 1, 1), date(2024, 1, 8), date(2023, 12, 29)),
+    (date(2024, 4, 28), date(2024, 5, 1), date(2024, 4, 27)),
+    (date(2025, 5, 1), date(2025, 5, 4), date(2025, 4, 30)),
+    (date(2025, 11, 2), date(2025, 11, 4), date(2025, 11, 1)),
+    (date(2026, 5, 9), date(2026, 5, 11), date(2026, 5, 8)),
+])
+def test_holiday_blocks_move_to_last_working_day(first, last, expected):
+    assert {previous_working_day(day) for day in days(first, last)} == {expected}
+
+
+@pytest.mark.parametrize('day', [date(2024, 4, 27), date(2024, 11, 2), date(2024, 12, 28), date(2025, 11, 1)])
+def test_transferred_working_days(day):
+    assert day.weekday() == 5
+    assert is_working_day(day)
+    assert previous_working_day(day) == day
+
+
+@pytest.mark.parametrize('day, expected', [
+    (date(2025, 1, 1), date(2024, 12, 28)),
+    (date(2025, 1, 8), date(2024, 12, 28)),
+    (date(2026, 1, 9), date(2025, 12, 30)),
+    (date(2026, 1, 1), date(2025, 12, 30)),
+])
+def test_year_boundaries(day, expected):
+    assert previous_working_day(day) == expected
+
+
+def test_regular_days():
+    assert previous_working_day(date(2025, 1, 9)) == date(2025, 1, 9)
+    assert previous_working_day(date(2025, 3, 16)) == date(2025, 3, 14)
+    assert not is_working_day(date(2025, 3, 15))
+
+
+def test_year_without_data_uses_weekends_only():
+    # 2027-01-01 в данных нет: пятница считается рабочим днем
+    assert is_working_day(date(2027, 1, 1))
+    assert not is_working_day(date(2027, 1, 2))
+    assert previous_working_day(date(2027, 1, 3)) == date(2027, 1, 1)
+    assert previous_working_day(date(2027, 1, 4)) == date(2027, 1, 4)
+    # Начало 2027 года продолжает отсчет от праздника 31.12.2026
+    assert previous_working_day(date(2026, 12, 31)) == date(2026, 12, 30)
+
+
+def test_missing_calendar_uses_weekends_only(tmp_path):
+    load_calendar(str(tmp_path / 'missing.txt'))
+    assert is_working_day(date(2025, 1, 8))
+    assert previous_working_day(date(2025, 1, 5)) == date(2025, 1, 3)
+
+
+def test_invalid_calendar_is_rejected(tmp_path):
+    path = tmp_path / 'calendar.txt'
+    path.write_text('2025-01-09 workday\n', encoding='utf-8')
+    with pytest.raises(ValueError):
+        load_calendar(str(path))
+    assert business_calendar._holidays
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# tests/test_migrations.py
+
+import sqlite3
+from datetime import date
+import pytest
+import database_manager
+from database_manager import MIGRATIONS, from_day_number, get_connection, init_db
+
+# Схема базы данных до появления миграций
+BASELINE_SCHEMA = '''
+CREATE TABLE notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    company TEXT,
+    product TEXT,
+    expiry_date TEXT,
+    notify_date TEXT,
+    quantity TEXT,
+    notification_type TEXT
+);
+CREATE TABLE monitored_sites (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    site TEXT UNIQUE COLLATE NOCASE,
+    expiry_date TEXT,
+    common_name TEXT
+);
+CREATE TABLE allowed_users (user_id INTEGER PRIMARY KEY, username TEXT, first_name TEXT, last_name TEXT);
+CREATE TABLE access_requests (user_id INTEGER PRIMARY KEY, username TEXT, first_name TEXT, last_name TEXT);
+CREATE TABLE allowed_chats (chat_id INTEGER PRIMARY KEY);
+'''
+
+
+@pytest.fixture
+def database_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'database.db')
+    database_manager.close_connection()
+    monkeypatch.setattr(database_manager, 'DB_PATH', path)
+    yield path
+    database_manager.close_connection()
+
+
+def create_baseline_database(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    for number in range(1, 6):
+        conn.execute(
+            'INSERT INTO notifications (user_id, company, product, expiry_date, notify_date, quantity, '
+            'notification_type) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (1, f'Company {number}', 'Product', f'2025-03-0{number}', '', '', 'лицензия'),
+        )
+        conn.execute(
+            'INSERT INTO monitored_sites (site, expiry_date, common_name) VALUES (?, ?, ?)',
+            (f'site{number}.example', '2025-03-01 12:00:00', f'site{number}.example'),
+        )
+    # Последние записи удалены: их id не должны выдаваться повторно
+    conn.execute('DELETE FROM notifications WHERE id IN (4, 5)')
+    conn.execute('DELETE FROM monitored_sites WHERE id IN (4, 5)')
+    conn.commit()
+    conn.close()
+
+
+def test_baseline_database_is_migrated(database_path):
+    create_baseline_database(database_path)
+    init_db()
+    conn = get_connection()
+    assert conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] == len(MIGRATIONS)
+
+    rows = conn.execute('SELECT id, expiry_day, company_key FROM notifications ORDER BY id').fetchall()
+    assert [(notif_id, from_day_number(day), key) for notif_id, day, key in rows] == [
+        (1, date(2025, 3, 1), 'company 1'),
+        (2, date(2025, 3, 2), 'company 2'),
+        (3, date(2025, 3, 3), 'company 3'),
+    ]
+    expiry_at = database_manager.LEGACY_TIMEZONE.localize(database_manager.datetime(2025, 3, 1, 12)).timestamp()
+    assert conn.execute('SELECT id, expiry_at, probe_state FROM monitored_sites ORDER BY id').fetchall() == [
+        (1, expiry_at, 'healthy'),
+        (2, expiry_at, 'healthy'),
+        (3, expiry_at, 'healthy'),
+    ]
+
+
+def test_migration_keeps_autoincrement_counters(database_path):
+    create_baseline_database(database_path)
+    init_db()
+    notif_id = database_manager.save_notification_to_db(
+        1, 'Company 6', 'Product', 20150, '', '', 'лицензия'
+    )
+    assert notif_id == 6
+    assert database_manager.add_monitored_site('site6.example')
+    conn = get_connection()
+    assert conn.execute("SELECT id FROM monitored_sites WHERE site = 'site6.example'").fetchone()[0] == 6
+
+
+def test_new_database(database_path):
+    init_db()
+    init_db()
+    conn = get_connection()
+    assert conn.execute('SELECT COUNT(*) FROM schema_version').fetchone()[0] == len(MIGRATIONS)
+    assert database_manager.save_notification_to_db(1, 'Company', 'Product', 20150, '', '', 'лицензия') == 1
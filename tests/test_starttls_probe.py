@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# tests/test_starttls_probe.py
+
+import asyncio
+import ssl
+from datetime import datetime, timedelta
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+import ssl_certificate_checker
+from ssl_certificate_checker import PROTOCOL_TLS, POSTGRES_SSL_REQUEST, STARTTLS_NEGOTIATORS, fetch_certificate
+
+
+@pytest.fixture(scope='module')
+def server_certificate(tmp_path_factory):
+    # Самоподписанный сертификат тестовых серверов: (DER, контекст TLS сервера)
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    now = datetime.utcnow()
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=30))
+        .sign(key, hashes.SHA256())
+    )
+    directory = tmp_path_factory.mktemp('certificate')
+    cert_path = directory / 'server.crt'
+    key_path = directory / 'server.key'
+    cert_path.write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(str(cert_path), str(key_path))
+    return certificate.public_bytes(serialization.Encoding.DER), context
+
+
+@pytest.fixture(autouse=True)
+def probe_settings(monkeypatch):
+    # Семафор создается в цикле событий первой проверки, а каждый тест запускает свой цикл
+    monkeypatch.setattr(ssl_certificate_checker, '_probe_semaphore', None)
+    monkeypatch.setattr(ssl_certificate_checker, 'SSL_CONNECT_TIMEOUT', 5)
+    monkeypatch.setattr(ssl_certificate_checker, 'SSL_HANDSHAKE_TIMEOUT', 5)
+
+
+async def upgrade_to_tls(writer, context):
+    loop = asyncio.get_running_loop()
+    transport = await loop.start_tls(writer.transport, writer.transport.get_protocol(), context, server_side=True)
+    # Соединение закрывает клиент, получив сертификат
+    await asyncio.sleep(5)
+    transport.close()
+
+
+async def smtp_server(reader, writer, context):
+    writer.write(b'220 mx.example ESMTP\r\n')
+    assert (await reader.readline()).startswith(b'EHLO ')
+    writer.write(b'250-mx.example\r\n250-SIZE 10240000\r\n250 STARTTLS\r\n')
+    assert await reader.readline() == b'STARTTLS\r\n'
+    writer.write(b'220 Ready to start TLS\r\n')
+    await writer.drain()
+    await upgrade_to_tls(writer, context)
+
+
+async def imap_server(reader, writer, context):
+    writer.write(b'* OK IMAP4rev1 ready\r\n')
+    assert await reader.readline() == b'A1 STARTTLS\r\n'
+    writer.write(b'* NOTE untagged line before the reply\r\nA1 OK Begin TLS negotiation now\r\n')
+    await writer.drain()
+    await upgrade_to_tls(writer, context)
+
+
+async def pop3_server(reader, writer, context):
+    writer.write(b'+OK POP3 ready\r\n')
+    assert await reader.readline() == b'STLS\r\n'
+    writer.write(b'+OK Begin TLS negotiation\r\n')
+    await writer.drain()
+    await upgrade_to_tls(writer, context)
+
+
+async def postgres_server(reader, writer, context):
+    assert await reader.readexactly(len(POSTGRES_SSL_REQUEST)) == POSTGRES_SSL_REQUEST
+    writer.write(b'S')
+    await writer.drain()
+    await upgrade_to_tls(writer, context)
+
+
+async def postgres_server_without_ssl(reader, writer, context):
+    await reader.readexactly(len(POSTGRES_SSL_REQUEST))
+    writer.write(b'N')
+    await writer.drain()
+    writer.close()
+
+
+async def silent_server(reader, writer, context):
+    # Принимает подключение и ничего не отвечает
+    await reader.read()
+    writer.close()
+
+
+SERVERS = {
+    'smtp': smtp_server,
+    'imap': imap_server,
+    'pop3': pop3_server,
+    'postgres': postgres_server,
+}
+
+
+async def probe(handler, context, protocol, server_ssl=None):
+    server = await asyncio.start_server(
+        lambda reader, writer: handler(reader, writer, context), '127.0.0.1', 0, ssl=server_ssl
+    )
+    port = server.sockets[0].getsockname()[1]
+    try:
+        return await fetch_certificate('127.0.0.1', port, protocol=protocol)
+    finally:
+        server.close()
+
+
+def test_every_negotiator_has_a_test_server():
+    assert set(SERVERS) == set(STARTTLS_NEGOTIATORS)
+
+
+@pytest.mark.parametrize('protocol', sorted(SERVERS))
+def test_starttls(protocol, server_certificate):
+    der_cert, context = server_certificate
+    assert asyncio.run(probe(SERVERS[protocol], context, protocol)) == der_cert
+
+
+def test_implicit_tls(server_certificate):
+    der_cert, context = server_certificate
+    assert asyncio.run(probe(silent_server, context, PROTOCOL_TLS, server_ssl=context)) == der_cert
+
+
+def test_postgres_without_ssl(server_certificate):
+    _, context = server_certificate
+    with pytest.raises(ConnectionError):
+        asyncio.run(probe(postgres_server_without_ssl, context, 'postgres'))
+
+
+def test_connect_timeout(monkeypatch):
+    async def hanging_connection(hostname, port, addresses=None):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(ssl_certificate_checker, 'open_tcp_connection', hanging_connection)
+    monkeypatch.setattr(ssl_certificate_checker, 'SSL_CONNECT_TIMEOUT', 0.1)
+    with pytest.raises(TimeoutError, match='подключения'):
+        asyncio.run(fetch_certificate('127.0.0.1', 443))
+
+
+@pytest.mark.parametrize('protocol', [PROTOCOL_TLS, 'smtp'])
+def test_handshake_timeout(protocol, server_certificate, monkeypatch):
+    _, context = server_certificate
+    monkeypatch.setattr(ssl_certificate_checker, 'SSL_HANDSHAKE_TIMEOUT', 0.2)
+    with pytest.raises(TimeoutError, match='TLS'):
+        asyncio.run(probe(silent_server, context, protocol))